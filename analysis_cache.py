@@ -0,0 +1,122 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+import cv2
+import numpy as np
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    ratio REAL,
+    tier TEXT,
+    ellipse TEXT,
+    mask BLOB,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used);
+"""
+
+def frame_hash(img):
+    """Content hash of a decoded frame (shape, dtype and pixels)."""
+    img = np.ascontiguousarray(img)
+    digest = hashlib.sha256("{}{}".format(img.shape, img.dtype).encode())
+    digest.update(img.data)
+    return digest.hexdigest()
+
+class AnalysisCache:
+    """Persistent cache of analysis results keyed by frame content and parameters.
+
+    Two kinds of entries share one SQLite table:
+    ratio entries hold (ratio, tier) for a frame, the full parameter set and
+    the well prior; mask entries hold the fitted ellipse and PNG-compressed
+    droplet mask for the segmentation parameters and prompt points only, so
+    changing the ellipse scale re-scores from the stored mask instead of
+    re-running FastSAM. The classification threshold is applied after the
+    cache and is never part of a key.
+    Least recently used entries are evicted once the stored size exceeds max_bytes.
+    """
+    def __init__(self, path="analysis_cache.sqlite", weights="FastSAM/weights/FastSAM-x.pt",
+                 max_bytes=256*1024*1024, store_masks=True):
+        self.path = path
+        self.weights = weights
+        self.max_bytes = max_bytes
+        self.store_masks = store_masks
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.executescript(SCHEMA)
+        self._size = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def close(self):
+        self.conn.close()
+
+    def key(self, frame_digest, kind, parameters):
+        """Entry key of a frame hash, an entry kind and a parameter dict."""
+        described = json.dumps({"kind": kind, "weights": self.weights, "parameters": parameters},
+                               sort_keys=True)
+        return hashlib.sha256((frame_digest + described).encode()).hexdigest()
+
+    def _get(self, key, columns):
+        with self._lock:
+            row = self.conn.execute("SELECT {} FROM entries WHERE key = ?".format(columns), (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            with self.conn:
+                self.conn.execute("UPDATE entries SET last_used = ? WHERE key = ?", (time.time(), key))
+            return row
+
+    def _put(self, key, ratio=None, tier=None, ellipse=None, mask=None):
+        size = 64 + len(ellipse or "") + (len(mask) if mask is not None else 0)
+        with self._lock, self.conn:
+            old = self.conn.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+            self.conn.execute("INSERT OR REPLACE INTO entries (key, ratio, tier, ellipse, mask, size, last_used)"
+                              " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                              (key, ratio, tier, ellipse, mask, size, time.time()))
+            self._size += size - (old[0] if old else 0)
+            while self._size > self.max_bytes:
+                victim = self.conn.execute(
+                    "SELECT key, size FROM entries ORDER BY last_used LIMIT 1").fetchone()
+                if victim is None:
+                    break
+                self.conn.execute("DELETE FROM entries WHERE key = ?", (victim[0],))
+                self._size -= victim[1]
+
+    def get_ratio(self, key):
+        """(ratio, tier) or None."""
+        row = self._get(key, "ratio, tier")
+        return None if row is None else (row[0], row[1])
+
+    def put_ratio(self, key, ratio, tier):
+        self._put(key, ratio=float(ratio), tier=tier)
+
+    def get_mask(self, key):
+        """(ellipse, mask) or None; ellipse is None when no contour was found."""
+        if not self.store_masks:
+            return None
+        row = self._get(key, "ellipse, mask")
+        if row is None:
+            return None
+        ellipse = json.loads(row[0])
+        if ellipse is not None:
+            (cx, cy), (h, w), deg = ellipse
+            ellipse = ((cx, cy), (h, w), deg)
+        mask = cv2.imdecode(np.frombuffer(row[1], dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+        return ellipse, mask
+
+    def put_mask(self, key, ellipse, mask):
+        if not self.store_masks:
+            return
+        ok, encoded = cv2.imencode(".png", mask)
+        if ok:
+            self._put(key, ellipse=json.dumps(ellipse), mask=encoded.tobytes())
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "bytes": self._size,
+                "entries": self.conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]}
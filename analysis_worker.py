@@ -0,0 +1,228 @@
+import argparse
+import itertools
+import os
+import subprocess
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import Future
+from multiprocessing.connection import Client, Listener
+
+AUTHKEY_ENV = "ANALYSIS_WORKER_AUTHKEY"
+
+
+class AnalysisWorker:
+  """
+  Long-lived process that holds a warmed-up FastSAM model
+  submit() sends frames or image paths and returns a Future of
+  [(ratio, tier), ...], so the caller can keep moving while it segments.
+  The worker is a separate interpreter (not a multiprocessing child), so
+  main.py and its devices are never re-imported on platforms that spawn.
+  """
+  def __init__(self, weights="FastSAM/weights/FastSAM-x.pt", analysis_mode="fastsam", artifacts="full",
+               cache=None, tracer=None, inference="default", threads=None, geometry=None):
+    """
+    weights: FastSAM checkpoint, or a model exported with inference.export_model
+    inference: "default" or "cpu" (see inference.configure_inference); threads: torch threads
+    cache: path of an AnalysisCache database; frames seen before are answered from it
+    geometry: path of a WellGeometry file; wells are searched around their learned circle
+    tracer: tracing.Tracer that receives the worker's analysis stage events
+    """
+    self.tracer = tracer
+    authkey = os.urandom(16)
+    self._listener = Listener(("localhost", 0), authkey=authkey)
+    env = dict(os.environ, **{AUTHKEY_ENV: authkey.hex()})
+    self._process = subprocess.Popen(
+      [sys.executable, os.path.abspath(__file__),
+       "--port", str(self._listener.address[1]),
+       "--weights", weights,
+       "--mode", analysis_mode,
+       "--artifacts", artifacts,
+       "--inference", inference] + (["--threads", str(threads)] if threads else [])
+      + (["--cache", cache] if cache else []) + (["--geometry", geometry] if geometry else [])
+      + (["--trace"] if tracer else []),
+      cwd=os.getcwd(), env=env)
+
+    self._ids = itertools.count()
+    self._futures = {}
+    self._lock = threading.Lock()
+    self._conn = None
+    self._connected = threading.Event()
+    self.ready = threading.Event()
+    # Traceback of a failed model load, or why the worker exited before it was ready
+    self.error = None
+    self._collector = threading.Thread(target=self._collect, daemon=True)
+    self._collector.start()
+
+  def _collect(self):
+    self._conn = self._listener.accept()
+    self._connected.set()
+    while True:
+      try:
+        job_id, result, error = self._conn.recv()
+      except (EOFError, OSError):
+        break
+      if job_id == "ready":
+        self.ready.set()
+        continue
+      if job_id == "failed":
+        self.error = error
+        print("Analysis worker failed to load the model:\n" + error)
+        continue
+      if job_id == "trace":
+        if self.tracer is not None:
+          self.tracer.extend(result)
+        continue
+      with self._lock:
+        future = self._futures.pop(job_id)
+      if error is None:
+        future.set_result(result)
+      else:
+        future.set_exception(RuntimeError(error))
+
+    with self._lock:
+      if not self.ready.is_set() and self.error is None:
+        self.error = "Analysis worker exited before the model was loaded"
+      futures, self._futures = list(self._futures.values()), {}
+    for future in futures:
+      future.set_exception(RuntimeError(self.error or "Analysis worker exited"))
+
+  def submit(self, images, names, result_dir):
+    """Queue frames (BGR arrays) or paths; names label the result images"""
+    while not self._connected.wait(timeout=1):
+      if self._process.poll() is not None:
+        raise RuntimeError("Analysis worker failed to start")
+    future = Future()
+    with self._lock:
+      if self.error is not None:
+        raise RuntimeError(self.error)
+      job_id = next(self._ids)
+      self._futures[job_id] = future
+      self._conn.send((job_id, list(images), list(names), result_dir))
+    return future
+
+  def close(self):
+    if self._connected.is_set():
+      with self._lock:
+        self._conn.send(None)
+    self._process.wait()
+    self._listener.close()
+
+
+def chain_future(future, fn):
+  """Future of fn(future.result())"""
+  chained = Future()
+  def done(f):
+    try:
+      chained.set_result(fn(f.result()))
+    except Exception as e:
+      chained.set_exception(e)
+  future.add_done_callback(done)
+  return chained
+
+
+def gather_futures(futures):
+  """Future of [f.result() for f in futures]; fails with the first error"""
+  gathered = Future()
+  futures = list(futures)
+  if not futures:
+    gathered.set_result([])
+    return gathered
+  remaining = [len(futures)]
+  lock = threading.Lock()
+  def done(f):
+    with lock:
+      remaining[0] -= 1
+      if gathered.done():
+        return
+      if f.exception() is not None:
+        gathered.set_exception(f.exception())
+      elif remaining[0] == 0:
+        gathered.set_result([future.result() for future in futures])
+  for future in futures:
+    future.add_done_callback(done)
+  return gathered
+
+
+def _serve(port, weights, analysis_mode, artifacts, cache_path=None, trace=False, inference="default",
+           threads=None, geometry_path=None):
+  """
+  Worker loop: load FastSAM (or an exported model) once, then analyze jobs until None arrives
+  A failed load is reported as ("failed", None, traceback) before exiting.
+  """
+  conn = Client(("localhost", port), authkey=bytes.fromhex(os.environ[AUTHKEY_ENV]))
+
+  try:
+    from analysis_cache import AnalysisCache
+    from artifact_writer import ArtifactWriter
+    from image_analysis import detect_coffee_rings_batch, detect_coffee_rings_tiered, load_fastsam, set_tracer
+    from inference import configure_inference
+    from tracing import Tracer
+    from well_geometry import WellGeometry
+
+    configure_inference(inference, threads=threads)
+    model = load_fastsam(weights)
+    writer = ArtifactWriter()
+    cache = AnalysisCache(cache_path, weights) if cache_path else None
+    geometry = WellGeometry(geometry_path) if geometry_path else None
+    tracer = Tracer() if trace else None
+    set_tracer(tracer)
+  except Exception:
+    conn.send(("failed", None, traceback.format_exc()))
+    conn.close()
+    return
+  conn.send(("ready", None, None))
+
+  while True:
+    try:
+      job = conn.recv()
+    except EOFError:
+      # The parent exited without close()
+      break
+    if job is None:
+      break
+    job_id, images, names, result_dir = job
+    start = time.time()
+    try:
+      if analysis_mode == "tiered":
+        result = detect_coffee_rings_tiered(model, images, result_dir, names=names,
+                                            artifacts=artifacts, writer=writer, cache=cache,
+                                            geometry=geometry)
+      else:
+        ratios = detect_coffee_rings_batch(model, images, result_dir, names=names,
+                                           artifacts=artifacts, writer=writer, cache=cache,
+                                           geometry=geometry)
+        result = [(ratio, "fastsam") for ratio in ratios]
+      result, error = [(float(ratio), tier) for ratio, tier in result], None
+    except Exception:
+      result, error = None, traceback.format_exc()
+    if tracer is not None:
+      tracer.record("job", "analysis", start*1e6, time.time()*1e6, {"images": len(images)})
+      conn.send(("trace", tracer.drain(), None))
+    conn.send((job_id, result, error))
+    try:
+      writer.flush()
+    except Exception:
+      traceback.print_exc()
+
+  writer.close()
+  if cache is not None:
+    cache.close()
+  conn.close()
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--port", type=int, required=True)
+  parser.add_argument("--weights", default="FastSAM/weights/FastSAM-x.pt")
+  parser.add_argument("--mode", default="fastsam")
+  parser.add_argument("--artifacts", default="full")
+  parser.add_argument("--cache", default=None)
+  parser.add_argument("--geometry", default=None)
+  parser.add_argument("--trace", action="store_true")
+  parser.add_argument("--inference", default="default")
+  parser.add_argument("--threads", type=int, default=None)
+  args = parser.parse_args()
+  _serve(args.port, args.weights, args.mode, args.artifacts, args.cache, args.trace, args.inference, args.threads,
+         args.geometry)
@@ -0,0 +1,42 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+
+ARTIFACT_LEVELS = ("none", "summary", "full")
+
+
+class ArtifactWriter:
+  """
+  Encode and save analysis images on a bounded background thread pool
+  imwrite() blocks only when max_pending images are already queued.
+  Call flush() at the end of an experiment to wait for every file.
+  """
+  def __init__(self, max_workers=2, max_pending=32):
+    self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="artifact")
+    self._slots = threading.BoundedSemaphore(max_pending)
+    self._lock = threading.Lock()
+    self._futures = []
+
+  def submit(self, fn, *args, **kwargs):
+    self._slots.acquire()
+    future = self._executor.submit(fn, *args, **kwargs)
+    future.add_done_callback(lambda _: self._slots.release())
+    with self._lock:
+      self._futures.append(future)
+    return future
+
+  def imwrite(self, path, img):
+    """Queue an image for encoding; img must not be modified afterwards"""
+    return self.submit(cv2.imwrite, path, img)
+
+  def flush(self):
+    """Wait for all queued writes; re-raise the first failure"""
+    with self._lock:
+      futures, self._futures = self._futures, []
+    for future in futures:
+      future.result()
+
+  def close(self):
+    self.flush()
+    self._executor.shutdown()
@@ -0,0 +1,108 @@
+import argparse
+import os
+
+import numpy as np
+
+from experiment_store import ExperimentStore, composition_grid, format_value
+
+PLATE_WELLS = 6
+
+def boundary_scores(grid, values, neighbours=4):
+    """Acquisition score of every grid point: high near the ring/no-ring boundary.
+    Uses the labels of the nearest measured points (inverse-distance weighted);
+    measured points score -inf. Stands in for NIMO's ranking when no
+    proposal scores are given.
+    """
+    grid = np.asarray(grid, dtype=float)
+    values = np.asarray(values, dtype=float)
+    measured = ~np.isnan(values)
+    scores = np.full(len(grid), -np.inf)
+    if not measured.any():
+        scores[:] = 0.0
+        return scores
+
+    scale = np.ptp(grid, axis=0)
+    scale[scale == 0] = 1.0
+    points = grid / scale
+    distances = np.linalg.norm(points[~measured, None, :] - points[None, measured, :], axis=2)
+    n = min(neighbours, measured.sum())
+    nearest = np.argpartition(distances, n - 1, axis=1)[:, :n]
+    nearest_distances = np.take_along_axis(distances, nearest, axis=1)
+    weights = 1.0 / (nearest_distances + 1e-6)
+    p = (weights * values[measured][nearest]).sum(axis=1) / weights.sum(axis=1)
+    # Disagreement of the neighbours, plus a small bonus for unexplored regions
+    scores[~measured] = 1.0 - 2.0*np.abs(p - 0.5) + 0.1*nearest_distances.min(axis=1)
+    return scores
+
+def select_batch(grid, values, k=PLATE_WELLS, scores=None, min_distance=0.1):
+    """Pick up to k unmeasured compositions for one plate
+    Greedy: take the best score, then drop every candidate closer than
+    min_distance (fraction of the grid range) to anything already picked,
+    relaxing it if that leaves fewer than k.
+    scores: acquisition score per grid point (e.g. from NIMO); boundary_scores by default.
+    Return value: (k, 2) array of (PVA, DTAB).
+    """
+    grid = np.asarray(grid, dtype=float)
+    values = np.asarray(values, dtype=float)
+    if scores is None:
+        scores = boundary_scores(grid, values)
+    scores = np.where(np.isnan(values), np.asarray(scores, dtype=float), -np.inf)
+
+    scale = np.ptp(grid, axis=0)
+    scale[scale == 0] = 1.0
+    points = grid / scale
+    picked = []
+    spacing = min_distance
+    while len(picked) < k and np.isfinite(scores).any():
+        available = scores.copy()
+        if picked:
+            distances = np.linalg.norm(points[:, None, :] - points[None, picked, :], axis=2).min(axis=1)
+            available[distances < spacing] = -np.inf
+        if not np.isfinite(available).any():
+            spacing /= 2
+            continue
+        best = int(np.argmax(available))
+        picked.append(best)
+        scores[best] = -np.inf
+    return grid[picked]
+
+def run_plate(store, lh, arm, compositions, debug=False):
+    """Prepare, heat and image one plate of compositions, then record them
+    The plate is the current one if its wells are unused, else the next floor of
+    the inventory's hotel_order.
+    Every well is recorded as its own iteration; candidates_N.csv is written for the last.
+    Return value: ([iteration per composition], [1 or 0 per composition])
+    """
+    compositions = [(float(pva), float(dtab)) for pva, dtab in compositions]
+    floor = lh.inventory.next_plate()
+    arm.plate_floor = floor
+    arm.load_plate(floor)
+    lh.prepare_samples([{"pva": pva, "dtab": dtab} for pva, dtab in compositions])
+    arm.heat_plate(debug=debug)
+    answers = arm.image_plate(range(len(compositions))).result()
+    arm.place_plate(floor)
+
+    iterations = store.record_many([(pva, dtab, answer) for (pva, dtab), answer in zip(compositions, answers)])
+    store.export_candidates(os.path.join(arm.result_path, "candidates_{}.csv".format(iterations[-1])), iterations[-1])
+    return iterations, answers
+
+def run_batch_cycle(store, lh, arm, k=PLATE_WELLS, scores=None, debug=False):
+    """Select k diverse compositions from the grid and measure them on one plate"""
+    grid = composition_grid()
+    compositions = select_batch(grid, store.results(grid), k, scores)
+    print("plate:", ", ".join("({}, {})".format(format_value(pva), format_value(dtab))
+                             for pva, dtab in compositions))
+    return run_plate(store, lh, arm, compositions, debug)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Propose the next plate of compositions")
+    parser.add_argument("--db", default="results/experiments.sqlite")
+    parser.add_argument("-k", type=int, default=PLATE_WELLS)
+    parser.add_argument("--min-distance", type=float, default=0.1)
+    args = parser.parse_args()
+
+    store = ExperimentStore(args.db)
+    grid = composition_grid()
+    for pva, dtab in select_batch(grid, store.results(grid), args.k, min_distance=args.min_distance):
+        print(format_value(pva), format_value(dtab))
+    store.close()
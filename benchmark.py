@@ -0,0 +1,158 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# CPU only, as on the analysis PC
+os.environ["CUDA_VISIBLE_DEVICES"] = ""
+
+import cv2
+import numpy as np
+
+from evaluation import find_raw_images
+import image_analysis as ia
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+STAGES = ["decode", "crop", "blur", "canny", "hough", "fastsam", "prompt", "classical",
+          "ellipse", "statistics", "artifacts"]
+
+def _peak_rss_mb():
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kilobytes on Linux, bytes on macOS
+        return peak / (1024*1024 if sys.platform == "darwin" else 1024)
+    try:
+        import psutil
+        return psutil.Process().memory_info().peak_wset / (1024*1024)
+    except (ImportError, AttributeError):
+        return None
+
+def _commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def _timed(timings, stage, fn, *args):
+    start = time.perf_counter()
+    out = fn(*args)
+    timings[stage].append(time.perf_counter() - start)
+    return out
+
+def _analyze(path, model, timings, result_dir):
+    img = _timed(timings, "decode", cv2.imread, path, cv2.IMREAD_COLOR)
+    crop = _timed(timings, "crop", ia._crop_center, img)
+    blur = _timed(timings, "blur", ia._blur, crop)
+    edges = _timed(timings, "canny", ia._canny, blur)
+    circle = _timed(timings, "hough", ia._hough_circle, edges)
+
+    root, ext = os.path.splitext(os.path.join(result_dir, os.path.basename(path)))
+    well = ia._Well(crop, os.path.basename(path), root, ext, edges,
+                    circle if circle is not None else ia.DEFAULT_CIRCLE, circle is not None)
+
+    if model is not None:
+        results = _timed(timings, "fastsam", ia._segment_everything, model, [crop], "cpu")
+        mask = _timed(timings, "prompt", ia._prompt_mask, well, results[:1], "cpu", "none")
+        ellipse = _timed(timings, "ellipse", ia._mask_ellipse, mask)
+    else:
+        ellipse, _, _ = _timed(timings, "classical", ia._classical_ellipse, well)
+        if ellipse is not None:
+            mask = np.zeros(crop.shape[:2], dtype=np.uint8)
+            cv2.ellipse(mask, ellipse, color=1, thickness=-1)
+    if ellipse is None:
+        return
+
+    def statistics_stage():
+        inner_mask, outer_mask = ia._ring_masks(mask, ellipse)
+        gray = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY)
+        return (gray, inner_mask, outer_mask) + ia._ring_statistics(gray, inner_mask, outer_mask)[1:]
+    gray, inner_mask, outer_mask, inner_img, outer_img = _timed(timings, "statistics", statistics_stage)
+    _timed(timings, "artifacts", ia._save_ring_artifacts, well, gray, inner_mask, outer_mask,
+           inner_img, outer_img, ellipse, "full", None)
+
+def run_benchmark(images, model=None, repeat=3):
+    """Time every analysis stage over images; returns a JSON-serialisable report."""
+    timings = {stage: [] for stage in STAGES}
+    with tempfile.TemporaryDirectory() as result_dir:
+        if model is not None:
+            # The first FastSAM call pays for lazy initialisation
+            ia._segment_everything(model, [ia._crop_center(cv2.imread(images[0]))], "cpu")
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for path in images:
+                _analyze(path, model, timings, result_dir)
+        elapsed = time.perf_counter() - start
+
+    stages = {}
+    for stage, values in timings.items():
+        if values:
+            stages[stage] = {
+                "calls": len(values),
+                "mean_ms": 1000*statistics.mean(values),
+                "median_ms": 1000*statistics.median(values),
+            }
+    return {
+        "commit": _commit(),
+        "images": len(images),
+        "repeat": repeat,
+        "fastsam": model is not None,
+        "stages": stages,
+        "throughput_images_per_s": len(images)*repeat / elapsed,
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+
+def print_report(report, baseline=None):
+    print("{:<12} {:>10} {:>10}".format("stage", "median ms", "mean ms") +
+          ("" if baseline is None else " {:>12} {:>8}".format("baseline ms", "ratio")))
+    for stage, row in report["stages"].items():
+        line = "{:<12} {:>10.2f} {:>10.2f}".format(stage, row["median_ms"], row["mean_ms"])
+        if baseline is not None and stage in baseline["stages"]:
+            base = baseline["stages"][stage]["median_ms"]
+            line += " {:>12.2f} {:>8.2f}".format(base, row["median_ms"] / base if base else float("nan"))
+        print(line)
+    print("throughput: {:.2f} images/s".format(report["throughput_images_per_s"]), end="")
+    if baseline is not None:
+        print(" (baseline {:.2f})".format(baseline["throughput_images_per_s"]), end="")
+    print()
+    if report["peak_rss_mb"] is not None:
+        print("peak RSS: {:.0f} MB".format(report["peak_rss_mb"]))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stage-level benchmark of image_analysis on the committed plates")
+    parser.add_argument("--results", default="results")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--weights", default="FastSAM/weights/FastSAM-x.pt")
+    parser.add_argument("--skip-fastsam", action="store_true",
+                        help="time the classical droplet fit instead of FastSAM")
+    parser.add_argument("--save", metavar="JSON", help="write the report as a baseline")
+    parser.add_argument("--compare", metavar="JSON", help="compare with a saved baseline")
+    parser.add_argument("--inference", choices=["default", "cpu"], default="default")
+    parser.add_argument("--threads", type=int, default=None)
+    args = parser.parse_args()
+
+    from inference import configure_inference
+    configure_inference(args.inference, threads=args.threads)
+
+    model = None
+    if not args.skip_fastsam:
+        model = ia.load_fastsam(args.weights)
+    images = find_raw_images(args.results)
+    report = run_benchmark(images, model, args.repeat)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,178 @@
+import argparse
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+import image_analysis as ia
+from evaluation import labeled_images
+
+PROFILE_STORE = "radial_profiles.npz"
+DEFAULT_SCALES = np.round(np.arange(0.5, 0.96, 0.02), 2)
+# ring_value = mean + k * std of the inner region
+DEFAULT_KS = np.round(np.arange(0.0, 2.01, 0.25), 2)
+DEFAULT_THRESHOLDS = np.round(np.arange(0.05, 0.61, 0.01), 2)
+
+def _image_key(path, results_dir):
+    return os.path.relpath(path, results_dir).replace(os.sep, "/")
+
+def _profile_file(path):
+    """Profile written by detect_coffee_ring next to the image (result_dir = image directory)."""
+    return os.path.splitext(path)[0] + "_profile.npz"
+
+def _compute_profiles(model, paths, mode, cache):
+    """Radial profiles of images without a stored one: classical ellipse where
+    the tiered test accepts it (mode "tiered"), FastSAM masks otherwise.
+    Without a model the FastSAM images get None.
+    """
+    frames = [ia._load_image(path) for path in paths]
+    wells = ia._prepare_wells(frames, "output", [os.path.basename(p) for p in paths], "none", None)
+    masks = [None] * len(wells)
+    if mode == "tiered":
+        for i, well in enumerate(wells):
+            ellipse, support, residual = ia._classical_ellipse(well)
+            if (ellipse is not None and support >= ia.CLASSICAL_MIN_SUPPORT
+                    and residual <= ia.CLASSICAL_MAX_RESIDUAL):
+                mask = np.zeros(well.crop.shape[:2], dtype=np.uint8)
+                cv2.ellipse(mask, ellipse, color=1, thickness=-1)
+                masks[i] = (ellipse, mask)
+    todo = [i for i, mask in enumerate(masks) if mask is None]
+    if todo and model is None:
+        print("skipping {} images that need FastSAM".format(len(todo)), file=sys.stderr)
+    elif todo:
+        hashes = [ia.frame_hash(frames[i]) for i in todo] if cache is not None else None
+        for i, found in zip(todo, ia._droplet_masks(model, [wells[i] for i in todo], artifacts="none",
+                                                    cache=cache, hashes=hashes)):
+            masks[i] = found
+
+    profiles = []
+    for well, found in zip(wells, masks):
+        if found is None:
+            profiles.append(None)
+            continue
+        ellipse, mask = found
+        if ellipse is None:
+            profiles.append(np.zeros((2, ia.PROFILE_RHO_BINS, 256), dtype=np.uint32))
+        else:
+            gray = cv2.cvtColor(well.crop, cv2.COLOR_BGR2GRAY)
+            profiles.append(ia.radial_profile(gray, mask, ellipse))
+    return profiles
+
+def load_profiles(results_dir="results", model=None, mode="tiered", cache=None):
+    """Radial profile and human label of every labelled image.
+    Profiles come from detect_coffee_ring's _profile.npz files, then from
+    results_dir/radial_profiles.npz, and are computed (and stored there) otherwise.
+    Returns (image keys, profiles (N, 2, R, 256), labels (N,)).
+    """
+    labeled = labeled_images(results_dir)
+    store_path = os.path.join(results_dir, PROFILE_STORE)
+    stored = dict(np.load(store_path)) if os.path.exists(store_path) else {}
+
+    keys = [_image_key(path, results_dir) for path, _ in labeled]
+    profiles = {}
+    for (path, _), key in zip(labeled, keys):
+        if os.path.exists(_profile_file(path)):
+            profiles[key] = np.load(_profile_file(path))["profile"]
+        elif key in stored:
+            profiles[key] = stored[key]
+    missing = [(path, key) for (path, _), key in zip(labeled, keys) if key not in profiles]
+    if missing:
+        print("computing {} radial profiles".format(len(missing)))
+        for (_, key), profile in zip(missing, _compute_profiles(model, [p for p, _ in missing], mode, cache)):
+            if profile is not None:
+                profiles[key] = stored[key] = profile
+        np.savez_compressed(store_path, **stored)
+
+    kept = [i for i, key in enumerate(keys) if key in profiles]
+    return ([keys[i] for i in kept], np.stack([profiles[keys[i]] for i in kept]),
+            np.array([labeled[i][1] for i in kept]))
+
+def ring_ratios(profiles, scales=DEFAULT_SCALES, ks=DEFAULT_KS):
+    """Ring ratio of every profile for every (scale, k) in one NumPy pass.
+    Matches _ring_statistics to within a few thousandths in ratio: inner = pixels inside the scaled ellipse,
+    outer = mask pixels outside it plus non-mask pixels inside it,
+    ratio = fraction of outer brighter than mean + k * std of inner.
+    Returns an array of shape (N, len(scales), len(ks)).
+    """
+    profiles = np.asarray(profiles, dtype=np.float64)
+    scales = np.asarray(scales, dtype=float)
+    ks = np.asarray(ks, dtype=float)
+    levels = np.arange(256, dtype=np.float64)
+
+    cumulative = np.cumsum(profiles, axis=2)                           # (N, 2, R, 256)
+    cut = np.clip(np.rint(scales / ia.PROFILE_RHO_STEP).astype(int) - 1, 0, ia.PROFILE_RHO_BINS - 1)
+    inside_mask = cumulative[:, 0, cut]                                # (N, S, 256)
+    outside_mask = cumulative[:, 1, cut]
+    total_mask = cumulative[:, 0, -1][:, None, :]
+    inner = inside_mask + outside_mask
+    outer = (total_mask - inside_mask) + outside_mask
+
+    n = np.maximum(inner.sum(axis=2), 1)
+    mean = inner @ levels / n
+    std = np.sqrt(np.maximum(inner @ levels**2 / n - mean**2, 0))
+    ring_value = mean[:, :, None] + ks[None, None, :] * std[:, :, None]  # (N, S, K)
+
+    # Pixels brighter than ring_value: levels >= floor(ring_value) + 1
+    first = np.clip(np.floor(ring_value).astype(int) + 1, 0, 256)
+    brighter = np.concatenate([np.cumsum(outer[:, :, ::-1], axis=2)[:, :, ::-1],
+                               np.zeros(outer.shape[:2] + (1,))], axis=2)  # (N, S, 257)
+    counts = np.take_along_axis(brighter, first, axis=2)
+    return counts / np.maximum(outer.sum(axis=2), 1)[:, :, None]
+
+def confusion(ratios, labels, thresholds=DEFAULT_THRESHOLDS):
+    """Confusion counts for every (scale, k, threshold).
+    Returns an int array (S, K, T, 4) of (tp, fp, fn, tn) against labels.
+    """
+    predicted = ratios[..., None] > np.asarray(thresholds)[None, None, None, :]  # (N, S, K, T)
+    positive = np.asarray(labels, dtype=bool)[:, None, None, None]
+    return np.stack([(predicted & positive).sum(axis=0), (predicted & ~positive).sum(axis=0),
+                     (~predicted & positive).sum(axis=0), (~predicted & ~positive).sum(axis=0)], axis=-1)
+
+def _nearest(values, value):
+    return int(np.argmin(np.abs(np.asarray(values) - value)))
+
+def calibrate(results_dir="results", model=None, mode="tiered", cache=None,
+              scales=DEFAULT_SCALES, ks=DEFAULT_KS, thresholds=DEFAULT_THRESHOLDS, top=5):
+    """Sweep (scale, k, threshold) over the labelled images and print the best settings."""
+    keys, profiles, labels = load_profiles(results_dir, model, mode, cache)
+    start = time.perf_counter()
+    ratios = ring_ratios(profiles, scales, ks)
+    counts = confusion(ratios, labels, thresholds)
+    elapsed = time.perf_counter() - start
+
+    accuracy = (counts[..., 0] + counts[..., 3]) / max(len(labels), 1)
+    current = (_nearest(scales, ia.INNER_ELLIPSE_SCALE), _nearest(ks, 1.0),
+               _nearest(thresholds, ia.RING_RATIO_THRESHOLD))
+    print("{} images, {} settings in {:.3f} s".format(len(labels), accuracy.size, elapsed))
+
+    def show(name, index):
+        tp, fp, fn, tn = counts[index]
+        print("{:<8} scale {:.2f} k {:.2f} threshold {:.2f}: accuracy {:.2f} (tp {} fp {} fn {} tn {})".format(
+            name, scales[index[0]], ks[index[1]], thresholds[index[2]], accuracy[index], tp, fp, fn, tn))
+    show("current", current)
+    for rank, flat in enumerate(np.argsort(-accuracy, axis=None, kind="stable")[:top]):
+        show("#{}".format(rank + 1), np.unravel_index(flat, accuracy.shape))
+    return {"keys": keys, "ratios": ratios, "confusion": counts, "accuracy": accuracy}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-score stored radial profiles over scale/k/threshold grids")
+    parser.add_argument("--results", default="results")
+    parser.add_argument("--mode", choices=["fastsam", "tiered"], default="tiered")
+    parser.add_argument("--weights", default="FastSAM/weights/FastSAM-x.pt")
+    parser.add_argument("--cache", default=None, help="AnalysisCache database with stored masks")
+    parser.add_argument("--top", type=int, default=5)
+    args = parser.parse_args()
+
+    model = None
+    if args.mode == "fastsam" or not os.path.exists(os.path.join(args.results, PROFILE_STORE)):
+        try:
+            model = ia.load_fastsam(args.weights)
+        except Exception as e:
+            print("FastSAM unavailable ({}); only classical profiles can be computed".format(e), file=sys.stderr)
+    cache = None
+    if args.cache:
+        from analysis_cache import AnalysisCache
+        cache = AnalysisCache(args.cache, args.weights)
+    calibrate(args.results, model, args.mode, cache, top=args.top)
@@ -0,0 +1,107 @@
+import functools
+import inspect
+import threading
+import time
+
+
+class DeferredDevice:
+  """
+  Stand-in for cls(*args, **kwargs) that builds the device on first use
+  Connecting, homing and loading models happen in the constructor, so
+  main.py wraps its devices in this to bind the web server at once.
+  Methods and attributes are forwarded to the device, which is built by the
+  first call (or by Readiness.warm_up in the background); concurrent first
+  calls wait for the same construction. A failed construction is retried
+  by the next call. Internal names start with _deferred_ so they never
+  shadow the device's own.
+  """
+  def __init__(self, cls, *args, **kwargs):
+    object.__setattr__(self, "_deferred_cls", cls)
+    object.__setattr__(self, "_deferred_args", (args, kwargs))
+    object.__setattr__(self, "_deferred_lock", threading.Lock())
+    object.__setattr__(self, "_deferred_instance", None)
+    object.__setattr__(self, "_deferred_state", {"state": "pending", "seconds": None, "error": None})
+
+  def _deferred_device(self):
+    """The device, built now if it is not yet"""
+    with self._deferred_lock:
+      if self._deferred_instance is None:
+        args, kwargs = self._deferred_args
+        self._deferred_state.update(state="starting", error=None)
+        start = time.monotonic()
+        try:
+          instance = self._deferred_cls(*args, **kwargs)
+        except Exception as e:
+          self._deferred_state.update(state="failed", error="{}: {}".format(type(e).__name__, e))
+          raise
+        object.__setattr__(self, "_deferred_instance", instance)
+        self._deferred_state.update(state="ready", seconds=round(time.monotonic() - start, 1))
+      return self._deferred_instance
+
+  def _deferred_status(self):
+    status = dict(self._deferred_state)
+    # The arm's analysis worker keeps loading FastSAM after the constructor returns
+    worker = getattr(self._deferred_instance, "analysis", None)
+    if worker is not None and hasattr(worker, "ready"):
+      error = getattr(worker, "error", None)
+      status["model"] = "ready" if worker.ready.is_set() else "failed" if error else "loading"
+      if error:
+        status["model_error"] = error
+    return status
+
+  def __getattr__(self, name):
+    if name.startswith("__") or name.startswith("_deferred_"):
+      raise AttributeError(name)
+    return getattr(self._deferred_device(), name)
+
+  def __setattr__(self, name, value):
+    setattr(self._deferred_device(), name, value)
+
+
+def _forward(name, method):
+  @functools.wraps(method)
+  def forward(self, *args, **kwargs):
+    return getattr(self._deferred_device(), name)(*args, **kwargs)
+  return forward
+
+
+def deferred(cls, *args, **kwargs):
+  """
+  DeferredDevice of cls(*args, **kwargs)
+  The public methods of cls are defined on it with their signatures and
+  docstrings, so IvoryOS and JobServer see the same interface as the device.
+  """
+  members = {name: _forward(name, method) for name, method in inspect.getmembers(cls, inspect.isfunction)
+             if not name.startswith("_")}
+  members.update(__module__=cls.__module__, __doc__=cls.__doc__)
+  return type(cls.__name__, (DeferredDevice,), members)(cls, *args, **kwargs)
+
+
+class Readiness:
+  """
+  Start-up state of the deferred devices, for IvoryOS to poll
+  status() gives, per device, "pending" (not built yet), "starting",
+  "ready" or "failed" with the error, plus the state of its analysis model
+  ("loading", "ready" or "failed" with model_error).
+  """
+  def __init__(self, **devices):
+    self.devices = devices
+
+  def warm_up(self, names: list = None):
+    """Build the devices (all by default) in background threads, one per device"""
+    for name in names or list(self.devices):
+      threading.Thread(target=self._build, args=(name,), name="warm-up-" + name, daemon=True).start()
+
+  def _build(self, name):
+    try:
+      self.devices[name]._deferred_device()
+    except Exception as e:
+      print("{} failed to start: {}".format(name, e))
+
+  def status(self) -> dict:
+    return {name: device._deferred_status() for name, device in self.devices.items()}
+
+  def ready(self) -> bool:
+    """True once every device is built and its analysis model loaded"""
+    return all(status["state"] == "ready" and status.get("model", "ready") == "ready"
+               for status in self.status().values())
@@ -0,0 +1,73 @@
+import argparse
+import csv
+import glob
+import os
+import re
+import time
+
+RAW_IMAGE_PATTERN = re.compile(r"^\d{14}_[A-Z]\d+\.jpg$")
+
+def find_raw_images(results_dir="results"):
+    """Raw well images (YYYYMMDDhhmmss_<well>.jpg) under results_dir/experiment*.
+    Derived images such as _crop or _hist are skipped.
+    """
+    paths = glob.glob(os.path.join(results_dir, "experiment*", "*.jpg"))
+    return sorted(p for p in paths if RAW_IMAGE_PATTERN.match(os.path.basename(p)))
+
+def load_summary(summary_path):
+    """Rows of results_summary.csv keyed by experiment number ("No")."""
+    with open(summary_path, newline="", encoding="utf-8-sig") as f:
+        return {int(row["No"]): row for row in csv.DictReader(f)}
+
+def labeled_images(results_dir="results"):
+    """(image path, human label) for every summarised experiment.
+    Row No N of results_summary.csv describes results/experimentNN.
+    """
+    summary = load_summary(os.path.join(results_dir, "results_summary.csv"))
+    labeled = []
+    for path in find_raw_images(results_dir):
+        match = re.search(r"experiment(\d+)$", os.path.dirname(path))
+        row = summary.get(int(match.group(1))) if match else None
+        if row is not None and row["result (human)"] != "":
+            labeled.append((path, int(row["result (human)"])))
+    return labeled
+
+def check_agreement(model, results_dir="results", mode="tiered"):
+    """Classify every labelled image and compare with result (human).
+    mode: "fastsam" (detect_coffee_rings_batch) or "tiered".
+    The tiered cut-offs and RING_RATIO_THRESHOLD were tuned on these same
+    images, so this is a consistency check rather than a held-out accuracy.
+    Returns the fraction of images that agree.
+    """
+    from image_analysis import RING_RATIO_THRESHOLD, detect_coffee_rings_batch, detect_coffee_rings_tiered
+
+    labeled = labeled_images(results_dir)
+    paths = [path for path, _ in labeled]
+    start = time.perf_counter()
+    if mode == "tiered":
+        answers = detect_coffee_rings_tiered(model, paths, results_dir, artifacts="none")
+    else:
+        answers = [(ratio, "fastsam") for ratio in
+                   detect_coffee_rings_batch(model, paths, results_dir, artifacts="none")]
+    elapsed = time.perf_counter() - start
+
+    agree = 0
+    print("{:<40} {:>7} {:>10} {:>5} {:>6}".format("image", "ratio", "tier", "auto", "human"))
+    for (path, human), (ratio, tier) in zip(labeled, answers):
+        auto = int(ratio > RING_RATIO_THRESHOLD)
+        agree += auto == human
+        print("{:<40} {:>7.3f} {:>10} {:>5} {:>6}".format(os.path.relpath(path, results_dir), ratio, tier, auto, human))
+    classical = sum(tier == "classical" for _, tier in answers)
+    print("agreement: {}/{}, classical tier: {}/{}, {:.2f} s/image".format(
+        agree, len(labeled), classical, len(labeled), elapsed / max(len(labeled), 1)))
+    return agree / max(len(labeled), 1)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check ring classification against result (human)")
+    parser.add_argument("--results", default="results")
+    parser.add_argument("--mode", choices=["fastsam", "tiered"], default="tiered")
+    parser.add_argument("--weights", default="FastSAM/weights/FastSAM-x.pt")
+    args = parser.parse_args()
+
+    from image_analysis import load_fastsam
+    check_agreement(load_fastsam(args.weights), args.results, args.mode)
@@ -0,0 +1,215 @@
+import argparse
+import csv
+import glob
+import os
+import re
+import sqlite3
+from datetime import datetime
+
+import numpy as np
+
+from evaluation import load_summary
+
+PVA_MAX = 0.04
+DTAB_MAX = 0.04
+GRID_STEP = 0.002
+CANDIDATE_FIELDS = ["PVA (%)", "DTAB (%)", "result"]
+SUMMARY_FIELDS = ["No", "PVA (%)", "DTAB (%)", "result (auto)", "result (human)"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS measurements (
+    id INTEGER PRIMARY KEY,
+    iteration INTEGER NOT NULL,
+    pva INTEGER NOT NULL,
+    dtab INTEGER NOT NULL,
+    result INTEGER NOT NULL,
+    ratio REAL,
+    image TEXT,
+    timestamp TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS measurements_composition ON measurements (pva, dtab);
+CREATE INDEX IF NOT EXISTS measurements_iteration ON measurements (iteration);
+CREATE INDEX IF NOT EXISTS measurements_timestamp ON measurements (timestamp);
+CREATE TABLE IF NOT EXISTS labels (
+    id INTEGER PRIMARY KEY,
+    iteration INTEGER NOT NULL,
+    result INTEGER NOT NULL,
+    timestamp TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS labels_iteration ON labels (iteration);
+"""
+
+# Compositions are stored as integer multiples of 1e-6 % so lookups are exact
+_SCALE = 1000000
+
+def _key(value):
+    return int(round(float(value) * _SCALE))
+
+def _value(key):
+    return key / _SCALE
+
+def format_value(value):
+    """Concentration as written in the CSVs ("0", "0.002", "0.04")."""
+    return "{:g}".format(round(float(value), 6))
+
+def composition_grid(pva_max=PVA_MAX, dtab_max=DTAB_MAX, step=GRID_STEP):
+    """(n, 2) array of (PVA, DTAB) in candidates_N.csv order: PVA major, DTAB minor."""
+    pva = np.round(np.arange(round(pva_max / step) + 1) * step, 6)
+    dtab = np.round(np.arange(round(dtab_max / step) + 1) * step, 6)
+    grid_pva, grid_dtab = np.meshgrid(pva, dtab, indexing="ij")
+    return np.column_stack([grid_pva.ravel(), grid_dtab.ravel()])
+
+class ExperimentStore:
+    """Append-only record of every measured composition.
+    Rows are never rewritten: a repeated composition adds a row and the
+    latest one wins, and human labels are appended to their own table.
+    The latest result per composition is kept in memory for O(1) lookup.
+    """
+    def __init__(self, path="results/experiments.sqlite"):
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript(SCHEMA)
+        self._latest = {}
+        for pva, dtab, result in self.conn.execute(
+                "SELECT pva, dtab, result FROM measurements ORDER BY id"):
+            self._latest[(pva, dtab)] = result
+
+    def close(self):
+        self.conn.close()
+
+    def record(self, pva, dtab, result, iteration=None, ratio=None, image=None, timestamp=None):
+        """Append one measurement; iteration defaults to the next one."""
+        if iteration is None:
+            iteration = self.last_iteration() + 1
+        if timestamp is None:
+            timestamp = datetime.now().isoformat(timespec="seconds")
+        key = (_key(pva), _key(dtab))
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO measurements (iteration, pva, dtab, result, ratio, image, timestamp)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (iteration, key[0], key[1], int(result), ratio, image, timestamp))
+        self._latest[key] = int(result)
+        return iteration
+
+    def record_many(self, rows, iteration=None):
+        """Append several (pva, dtab, result) measurements, e.g. the wells of one plate.
+        Each row gets the next iteration, so every well has its own results_summary.csv
+        row and label; a given iteration records them all under it (the seeds).
+        Return value: the iteration of every row
+        """
+        iterations = []
+        for pva, dtab, result in rows:
+            iterations.append(self.record(pva, dtab, result, iteration))
+        return iterations
+
+    def label(self, iteration, result, timestamp=None):
+        """Append the human label of an iteration."""
+        if timestamp is None:
+            timestamp = datetime.now().isoformat(timespec="seconds")
+        with self.conn:
+            self.conn.execute("INSERT INTO labels (iteration, result, timestamp) VALUES (?, ?, ?)",
+                              (iteration, int(result), timestamp))
+
+    def last_iteration(self):
+        row = self.conn.execute("SELECT MAX(iteration) FROM measurements").fetchone()
+        return row[0] if row[0] is not None else -1
+
+    def result(self, pva, dtab):
+        """Latest result measured for a composition, or None."""
+        return self._latest.get((_key(pva), _key(dtab)))
+
+    def results(self, compositions, iteration=None):
+        """Results aligned with an (n, 2) composition array; NaN where unmeasured.
+        iteration: only count measurements up to that iteration.
+        """
+        compositions = np.asarray(compositions, dtype=float)
+        keys = np.rint(compositions * _SCALE).astype(np.int64)
+        if iteration is None:
+            latest = self._latest
+        else:
+            latest = {}
+            for pva, dtab, result in self.conn.execute(
+                    "SELECT pva, dtab, result FROM measurements WHERE iteration <= ? ORDER BY id",
+                    (iteration,)):
+                latest[(pva, dtab)] = result
+        values = np.full(len(keys), np.nan)
+        if latest:
+            measured = np.array(list(latest.keys()), dtype=np.int64)
+            measured_results = np.array(list(latest.values()), dtype=float)
+            # Match rows by a single int64 code per composition
+            codes = keys[:, 0] * (100 * _SCALE) + keys[:, 1]
+            measured_codes = measured[:, 0] * (100 * _SCALE) + measured[:, 1]
+            order = np.argsort(measured_codes)
+            position = np.searchsorted(measured_codes[order], codes)
+            position = np.clip(position, 0, len(order) - 1)
+            found = measured_codes[order][position] == codes
+            values[found] = measured_results[order][position[found]]
+        return values
+
+    def export_candidates(self, path, iteration=None, grid=None):
+        """Write the candidates_N.csv layout NIMO reads (empty result when unmeasured)."""
+        if grid is None:
+            grid = composition_grid()
+        values = self.results(grid, iteration)
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f, lineterminator="\n")
+            writer.writerow(CANDIDATE_FIELDS)
+            for (pva, dtab), value in zip(grid, values):
+                writer.writerow([format_value(pva), format_value(dtab),
+                                 "" if np.isnan(value) else int(value)])
+        return path
+
+    def export_summary(self, path):
+        """Write results_summary.csv: one row per iteration after the seeds."""
+        labels = dict(self.conn.execute("SELECT iteration, result FROM labels ORDER BY id").fetchall())
+        rows = self.conn.execute(
+            "SELECT iteration, pva, dtab, result FROM measurements WHERE iteration > 0 ORDER BY iteration, id")
+        with open(path, "w", newline="", encoding="utf-8-sig") as f:
+            writer = csv.writer(f, lineterminator="\n")
+            writer.writerow(SUMMARY_FIELDS)
+            for iteration, pva, dtab, result in rows:
+                writer.writerow([iteration, format_value(_value(pva)), format_value(_value(dtab)),
+                                 result, labels.get(iteration, "")])
+        return path
+
+def import_results(store, results_dir="results"):
+    """Load the existing CSVs: labelled rows of candidates_0.csv as iteration 0,
+    then one iteration per results_summary.csv row.
+    """
+    if store.last_iteration() >= 0:
+        raise ValueError("{} already holds measurements".format(store.path))
+    seeds = glob.glob(os.path.join(results_dir, "experiment*", "candidates_0.csv"))
+    if seeds:
+        with open(seeds[0], newline="", encoding="utf-8-sig") as f:
+            rows = [(row["PVA (%)"], row["DTAB (%)"], row["result"]) for row in csv.DictReader(f)
+                    if row["result"] != ""]
+        store.record_many(rows, iteration=0)
+    summary = load_summary(os.path.join(results_dir, "results_summary.csv"))
+    for no, row in sorted(summary.items()):
+        images = glob.glob(os.path.join(results_dir, "experiment{:02d}".format(no), "*.jpg"))
+        raw = sorted(p for p in images if re.match(r"^\d{14}_[A-Z]\d+\.jpg$", os.path.basename(p)))
+        store.record(row["PVA (%)"], row["DTAB (%)"], row["result (auto)"], iteration=no,
+                     image=os.path.relpath(raw[0], results_dir).replace(os.sep, "/") if raw else None)
+        if row["result (human)"] != "":
+            store.label(no, row["result (human)"])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Experiment store: import the CSVs or export them for NIMO")
+    parser.add_argument("command", choices=["import", "candidates", "summary"])
+    parser.add_argument("--db", default="results/experiments.sqlite")
+    parser.add_argument("--results", default="results")
+    parser.add_argument("--iteration", type=int, default=None)
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    store = ExperimentStore(args.db)
+    if args.command == "import":
+        import_results(store, args.results)
+        print("imported iterations 0-{}".format(store.last_iteration()))
+    elif args.command == "candidates":
+        iteration = store.last_iteration() if args.iteration is None else args.iteration
+        print(store.export_candidates(args.output or "candidates_{}.csv".format(iteration), iteration))
+    else:
+        print(store.export_summary(args.output or "results_summary.csv"))
+    store.close()
@@ -0,0 +1,128 @@
+import csv
+import time
+
+import numpy as np
+
+from jobs import cancel_requested, report_progress
+
+
+def hotplate_temperature(hotplate):
+  """
+  Read the IKA plate temperature (IN_PV_1)
+  None if the plate does not answer in time or the reply can not be parsed:
+  a telemetry glitch must not end the heating.
+  """
+  try:
+    reply = hotplate.query('IN_PV_1')
+  except Exception as e:
+    from pyvisa.errors import VisaIOError
+    if not isinstance(e, VisaIOError):
+      raise
+    print("hotplate did not answer: {}".format(e))
+    return None
+  try:
+    return float(reply.split()[0])
+  except (ValueError, IndexError):
+    return None
+
+
+def frame_change(previous, frame, size=64):
+  """
+  Mean absolute difference (0-255) between two frames shrunk to size x size gray
+  Wet droplets keep changing while they dry; a dry one stays put.
+  """
+  import cv2
+  def small(img):
+    if img.ndim == 3:
+      img = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    return cv2.resize(img, (size, size), interpolation=cv2.INTER_AREA).astype(np.float32)
+  return float(np.mean(np.abs(small(frame) - small(previous))))
+
+
+def camera_frame_source(index=1, width=320):
+  """
+  Frame source for a camera looking at the hotplate, one low-resolution frame per call
+  A second camera: the imaging camera (index 0) is fixed, and the arm carries the
+  plate to it only after heating.
+  """
+  import cv2
+  cap = cv2.VideoCapture(index)
+  cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+  cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+  def read():
+    cap.grab()
+    ok, frame = cap.read()
+    return [frame] if ok else []
+  return read
+
+
+class HeatingController:
+  """
+  Heat a plate until its drops are dry, or for max_seconds at most
+  hotplate: open VISA session to the IKA plate, kept for the whole run.
+  frame_source: optional callable returning one frame per drop well (or a
+  single frame of the plate). Heating ends once every frame changed by less
+  than stable_change for stable_polls polls in a row, after min_seconds.
+  Without a frame source this is the fixed-time protocol with telemetry.
+  """
+  def __init__(self, hotplate, setpoint=60, max_seconds=3600, min_seconds=600, poll=30,
+               frame_source=None, stable_change=1.5, stable_polls=3):
+    self.hotplate = hotplate
+    self.setpoint = setpoint
+    self.max_seconds = max_seconds
+    self.min_seconds = min(min_seconds, max_seconds)
+    self.poll = poll
+    self.frame_source = frame_source
+    self.stable_change = stable_change
+    self.stable_polls = stable_polls
+    self.timeline = []
+
+  def _dryness(self, previous):
+    """Largest frame change over the wells, and the frames to compare against next time"""
+    frames = self.frame_source() if self.frame_source else []
+    if not frames or previous is None or len(previous) != len(frames):
+      return None, frames
+    return max(frame_change(p, f) for p, f in zip(previous, frames)), frames
+
+  def run(self):
+    """
+    Return value: (seconds heated, reason) with reason "dry", "max_time" or
+    "cancelled" (the JobServer job running this was cancelled)
+    """
+    self.timeline = []
+    self.hotplate.write('OUT_SP_1 {}'.format(self.setpoint))
+    self.hotplate.write('START_1')
+    start = time.monotonic()
+    previous = None
+    stable = 0
+    reason = "max_time"
+    try:
+      while True:
+        elapsed = time.monotonic() - start
+        temperature = hotplate_temperature(self.hotplate)
+        change, previous = self._dryness(previous)
+        stable = stable + 1 if change is not None and change < self.stable_change else 0
+        self.timeline.append({"seconds": round(elapsed, 1), "temperature": temperature,
+                              "change": None if change is None else round(change, 3), "stable": stable})
+        print("heating {:.0f} s: {} C, change {}".format(elapsed, temperature, change))
+        report_progress("heating", seconds=elapsed, temperature=temperature, change=change)
+
+        if cancel_requested():
+          reason = "cancelled"
+          break
+
+        if elapsed >= self.min_seconds and stable >= self.stable_polls:
+          reason = "dry"
+          break
+        if elapsed >= self.max_seconds:
+          break
+        time.sleep(min(self.poll, max(0.0, self.max_seconds - elapsed)))
+    finally:
+      self.hotplate.write('STOP_1')
+    return time.monotonic() - start, reason
+
+  def save_timeline(self, path):
+    with open(path, "w", newline="") as f:
+      writer = csv.DictWriter(f, fieldnames=["seconds", "temperature", "change", "stable"])
+      writer.writeheader()
+      writer.writerows(self.timeline)
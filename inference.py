@@ -0,0 +1,97 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+import image_analysis as ia
+from evaluation import labeled_images
+
+INFERENCE_MODES = ("default", "cpu")
+# FastSAM runs at a multiple of its 32 px stride; 608 is the closest to the 600 px crop
+CPU_IMGSZ = 608
+
+def configure_inference(mode="default", imgsz=None, threads=None):
+    """Select the FastSAM settings used by image_analysis.
+    "default": retina masks at imgsz 1024, as the analysis was validated.
+    "cpu": no upsampling of the crop (imgsz 608) and masks at inference
+    resolution, which is all fitEllipse needs.
+    threads: torch intra-op threads (default: leave torch's choice).
+    The settings are part of the analysis cache key, so cached results of
+    one mode are never returned for the other.
+    """
+    if mode not in INFERENCE_MODES:
+        raise ValueError("mode must be one of {}".format(INFERENCE_MODES))
+    if mode == "cpu":
+        ia.SEGMENT_PARAMETERS.update(retina_masks=False, imgsz=imgsz or CPU_IMGSZ)
+    else:
+        ia.SEGMENT_PARAMETERS.update(retina_masks=True, imgsz=imgsz or 1024)
+    if threads:
+        import torch
+        torch.set_num_threads(threads)
+    return dict(ia.SEGMENT_PARAMETERS)
+
+def export_model(weights="FastSAM/weights/FastSAM-x.pt", fmt="onnx", imgsz=CPU_IMGSZ):
+    """Export the checkpoint next to it (FastSAM-x.onnx / .torchscript) for faster CPU inference.
+    An exported model has a fixed input size; use it with the same imgsz.
+    """
+    model = ia.load_fastsam(weights)
+    return model.export(format=fmt, imgsz=imgsz)
+
+def _run(model, paths, mode, imgsz, threads):
+    configure_inference(mode, imgsz, threads)
+    start = time.perf_counter()
+    ratios = ia.detect_coffee_rings_batch(model, paths, "output", artifacts="none", batch_size=1)
+    return np.array(ratios, dtype=float), (time.perf_counter() - start) / max(len(paths), 1)
+
+def check_accuracy(weights="FastSAM/weights/FastSAM-x.pt", fast_weights=None, results_dir="results",
+                   imgsz=CPU_IMGSZ, threads=None):
+    """Compare the CPU mode with the default mode on every labelled image.
+    fast_weights: exported model for the CPU mode (default: weights).
+    Returns seconds/image of both modes, the largest ratio change, and
+    agreement with result (human) of both modes.
+    """
+    labeled = labeled_images(results_dir)
+    paths = [path for path, _ in labeled]
+    human = np.array([label for _, label in labeled])
+    os.makedirs("output", exist_ok=True)
+
+    reference, reference_s = _run(ia.load_fastsam(weights), paths, "default", None, threads)
+    fast, fast_s = _run(ia.load_fastsam(fast_weights or weights), paths, "cpu", imgsz, threads)
+    configure_inference("default")
+
+    reference_class = (reference > ia.RING_RATIO_THRESHOLD).astype(int)
+    fast_class = (fast > ia.RING_RATIO_THRESHOLD).astype(int)
+    print("{:<40} {:>8} {:>8} {:>6}".format("image", "default", "cpu", "human"))
+    for path, r, f, h in zip(paths, reference, fast, human):
+        print("{:<40} {:>8.3f} {:>8.3f} {:>6}".format(os.path.relpath(path, results_dir), r, f, h))
+    report = {
+        "default_s_per_image": reference_s,
+        "cpu_s_per_image": fast_s,
+        "max_ratio_change": float(np.max(np.abs(fast - reference))) if len(paths) else 0.0,
+        "classification_changes": int(np.sum(reference_class != fast_class)),
+        "default_agreement": float(np.mean(reference_class == human)) if len(paths) else 0.0,
+        "cpu_agreement": float(np.mean(fast_class == human)) if len(paths) else 0.0,
+    }
+    print("default {default_s_per_image:.2f} s/image, cpu {cpu_s_per_image:.2f} s/image, "
+          "max ratio change {max_ratio_change:.3f}, classification changes {classification_changes}, "
+          "agreement with human {default_agreement:.2f} -> {cpu_agreement:.2f}".format(**report))
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CPU inference mode: export FastSAM and check it against the labels")
+    parser.add_argument("--weights", default="FastSAM/weights/FastSAM-x.pt")
+    parser.add_argument("--export", choices=["onnx", "torchscript"], default=None,
+                        help="export the model first and check the exported one")
+    parser.add_argument("--imgsz", type=int, default=CPU_IMGSZ)
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--results", default="results")
+    args = parser.parse_args()
+
+    os.environ["CUDA_VISIBLE_DEVICES"] = ""
+    fast_weights = None
+    if args.export:
+        fast_weights = export_model(args.weights, args.export, args.imgsz)
+        print("exported", fast_weights, file=sys.stderr)
+    check_accuracy(args.weights, fast_weights, args.results, args.imgsz, args.threads)
@@ -0,0 +1,137 @@
+import json
+import os
+import threading
+from datetime import datetime
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "deck_inventory.json")
+
+# Cursor -> (initial value, capacity)
+# Mix wells used before the inventory existed:
+# 28-37, 25-27 (20251202), 15-24, 12-14 (20251126), 8-10 (20251121), 7 (20251120),
+# 6 (20251118), 0-5 (20251114), 84-88 (20251113), 89-95 (20251112)
+CURSORS = {
+  "next_tip": (44, 192),       # tip_rack1 then tip_rack2
+  "next_mix_well": (38, 96),   # mix_plate
+  "next_drop_well": (0, 6),    # next drop plate well the OT-2 fills
+  "next_image_well": (0, 6),   # next drop plate well the arm images
+  "plate_floor": (5, 12),      # plate hotel, two stacks of six
+}
+
+# Order in which plates are taken from the hotel: down the first stack from
+# its top floor, as place_plate's old "plate_floor -= 1" did, then the second
+HOTEL_ORDER = (5, 4, 3, 2, 1, 0, 11, 10, 9, 8, 7, 6)
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+def shared_inventory(path=DEFAULT_PATH):
+  """The DeckInventory of path, created once so every device shares it"""
+  with _shared_lock:
+    if path not in _shared:
+      _shared[path] = DeckInventory(path)
+    return _shared[path]
+
+
+class DeckInventory:
+  """
+  Consumables and positions shared by OT2 and RoboticArm
+  Each cursor is the next free tip, mix well, drop well or hotel floor, so
+  allocation is O(1). Every change is written atomically (temporary file
+  and os.replace), so a crash never leaves a half-written file and a
+  restart resumes where the last operation ended. state holds device flags
+  used for warm restarts; history replaces the ranges kept in comments.
+  path None keeps the inventory in memory only.
+  hotel_order: hotel floors in the order next_plate takes their plates.
+  """
+  def __init__(self, path=DEFAULT_PATH, history_size=500, hotel_order=HOTEL_ORDER):
+    self.path = path
+    self.history_size = history_size
+    self.hotel_order = list(hotel_order)
+    self._lock = threading.RLock()
+    self.cursors = {name: initial for name, (initial, _) in CURSORS.items()}
+    self.state = {}
+    self.history = []
+    if path is not None and os.path.exists(path):
+      with open(path) as f:
+        saved = json.load(f)
+      self.cursors.update(saved.get("cursors", {}))
+      self.state = saved.get("state", {})
+      self.history = saved.get("history", [])
+
+  def get(self, name):
+    return self.cursors[name]
+
+  def set(self, name, value):
+    if name not in CURSORS:
+      raise KeyError(name)
+    with self._lock:
+      if self.cursors[name] != value:
+        self.cursors[name] = value
+        self._log(name, value)
+        self.save()
+
+  def allocate(self, name, count=1):
+    """Take count consecutive items; returns the first index"""
+    with self._lock:
+      start = self.cursors[name]
+      if start + count > CURSORS[name][1]:
+        raise ValueError("Only {} left for {}".format(CURSORS[name][1] - start, name))
+      self.set(name, start + count)
+      return start
+
+  def remaining(self, name):
+    return CURSORS[name][1] - self.cursors[name]
+
+  def new_plate(self, floor):
+    """Start an empty drop plate taken from hotel floor"""
+    with self._lock:
+      self.set("plate_floor", floor)
+      self.set("next_drop_well", 0)
+      self.set("next_image_well", 0)
+
+  def next_plate(self):
+    """
+    Hotel floor of an empty drop plate, started with new_plate
+    The current plate is kept while none of its wells is used; otherwise
+    the floor after it in hotel_order is taken, and ValueError is raised
+    when the hotel is used up.
+    """
+    with self._lock:
+      floor = self.cursors["plate_floor"]
+      if self.cursors["next_drop_well"] or self.cursors["next_image_well"]:
+        if floor not in self.hotel_order:
+          raise ValueError("Hotel floor {} is not in hotel_order".format(floor))
+        position = self.hotel_order.index(floor) + 1
+        if position >= len(self.hotel_order):
+          raise ValueError("No empty plate left in the hotel")
+        floor = self.hotel_order[position]
+      self.new_plate(floor)
+      return floor
+
+  def set_state(self, **flags):
+    with self._lock:
+      if any(self.state.get(key) != value for key, value in flags.items()):
+        self.state.update(flags)
+        self.save()
+
+  def _log(self, name, value):
+    self.history.append({"time": datetime.now().isoformat(timespec="seconds"), "cursor": name, "value": value})
+    del self.history[:-self.history_size]
+
+  def save(self):
+    if self.path is None:
+      return
+    with self._lock:
+      tmp = self.path + ".tmp"
+      with open(tmp, "w") as f:
+        json.dump({"cursors": self.cursors, "state": self.state, "history": self.history}, f, indent=1)
+        f.flush()
+        os.fsync(f.fileno())
+      os.replace(tmp, self.path)
+
+
+def inventory_property(name):
+  """Attribute of a device that reads and writes cursor name of self.inventory"""
+  return property(lambda self: self.inventory.get(name),
+                  lambda self, value: self.inventory.set(name, value))
@@ -0,0 +1,132 @@
+import itertools
+import json
+import threading
+import time
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+
+_local = threading.local()
+
+
+def report_progress(message, **values):
+  """Add a progress event to the job running on this thread (no-op outside jobs)"""
+  job = getattr(_local, "job", None)
+  if job is not None:
+    job.events.append(dict(values, time=time.time(), message=message))
+
+
+def cancel_requested() -> bool:
+  """True once the job running on this thread was asked to stop"""
+  job = getattr(_local, "job", None)
+  return job is not None and job.cancel.is_set()
+
+
+class Job:
+  def __init__(self, job_id, device, method, kwargs):
+    self.id = job_id
+    self.device = device
+    self.method = method
+    self.kwargs = kwargs
+    self.state = "queued"
+    self.events = []
+    self.cancel = threading.Event()
+    self.submitted = time.time()
+    self.started = None
+    self.finished = None
+    self.future = None
+
+  def describe(self):
+    return {
+      "id": self.id, "device": self.device, "method": self.method, "kwargs": self.kwargs,
+      "state": self.state, "submitted": self.submitted, "started": self.started,
+      "finished": self.finished, "events": list(self.events),
+    }
+
+
+class JobServer:
+  """
+  Non-blocking front end for the device objects exposed to IvoryOS
+  Each device gets its own serial queue (one worker thread), so calls to
+  one instrument keep their order while different instruments overlap.
+  submit() returns a job id at once; status(), result() and cancel() take it.
+  Long operations report progress with report_progress() and stop early
+  when cancel_requested() turns true.
+  """
+  def __init__(self, **devices):
+    self.devices = devices
+    self._queues = {name: ThreadPoolExecutor(max_workers=1, thread_name_prefix="jobs-" + name)
+                    for name in devices}
+    self._jobs = {}
+    self._ids = itertools.count()
+    self._lock = threading.Lock()
+
+  def submit(self, device: str, method: str, arguments: str = "{}") -> str:
+    """
+    Queue device.method(**arguments); arguments is a JSON object
+    Return value: job id
+    """
+    if device not in self.devices:
+      raise ValueError("Unknown device: {}".format(device))
+    # Looked up on the class: an instance lookup on a DeferredDevice would build (connect, home) the device
+    if method.startswith("_") or not callable(getattr(type(self.devices[device]), method, None)):
+      raise ValueError("Unknown method: {}.{}".format(device, method))
+    kwargs = json.loads(arguments) if isinstance(arguments, str) else dict(arguments or {})
+
+    with self._lock:
+      job = Job("{}-{}".format(device, next(self._ids)), device, method, kwargs)
+      self._jobs[job.id] = job
+    job.future = self._queues[device].submit(self._run, job)
+    return job.id
+
+  def _run(self, job):
+    if job.cancel.is_set():
+      job.state = "cancelled"
+      raise CancelledError()
+    job.state = "running"
+    job.started = time.time()
+    _local.job = job
+    try:
+      result = getattr(self.devices[job.device], job.method)(**job.kwargs)
+      job.state = "cancelled" if job.cancel.is_set() else "done"
+      return result
+    except Exception as e:
+      job.state = "failed"
+      job.events.append({"time": time.time(), "message": "error: {}".format(e)})
+      raise
+    finally:
+      _local.job = None
+      job.finished = time.time()
+
+  def _job(self, job_id):
+    try:
+      return self._jobs[job_id]
+    except KeyError:
+      raise ValueError("Unknown job: {}".format(job_id))
+
+  def status(self, job_id: str) -> dict:
+    return self._job(job_id).describe()
+
+  def result(self, job_id: str, timeout: float = None):
+    """Wait for a job (at most timeout seconds) and return its value"""
+    return self._job(job_id).future.result(timeout)
+
+  def cancel(self, job_id: str) -> bool:
+    """
+    Cancel a queued job, or ask a running one to stop at its next check
+    Return value: False if the job had already finished
+    """
+    job = self._job(job_id)
+    if job.state in ("done", "failed", "cancelled"):
+      return False
+    job.cancel.set()
+    if job.future.cancel():
+      job.state = "cancelled"
+      job.finished = time.time()
+    return True
+
+  def jobs(self, device: str = None) -> list:
+    """Status of every job (of one device), oldest first"""
+    return [job.describe() for job in self._jobs.values() if device is None or job.device == device]
+
+  def close(self):
+    for queue in self._queues.values():
+      queue.shutdown(wait=True)
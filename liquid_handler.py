@@ -1,38 +1,44 @@
 import asyncio
-import nest_asyncio
-nest_asyncio.apply()
-from concurrent.futures import ThreadPoolExecutor
-
-from pylabrobot.liquid_handling import LiquidHandler
-from pylabrobot.liquid_handling.backends import OpentronsBackend
-from pylabrobot.resources.opentrons import (
-  OTDeck,
-  opentrons_96_tiprack_1000ul,
-  opentrons_96_tiprack_300ul,
-  corning_12_wellplate_6point9ml_flat,
-  corning_6_wellplate_16point8ml_flat,
-  thermoscientificnunc_96_wellplate_1300ul
-)
-from pylabrobot.resources import Coordinate
+import threading
+
+from inventory import DeckInventory, inventory_property, shared_inventory
+
+# (diluted, concentrated) stock wells of PVA, SDS, DTAB and PVP on the surfactant plate
+SURFACTANT_WELLS = [("A1", "B1"), ("A2", "B2"), ("A3", "B3"), ("C4", "B4")]
 
 class OT2:
-  def __init__(self):
-    self.lh = LiquidHandler(backend=OpentronsBackend(host="169.254.211.53"), deck=OTDeck())
-
-    self.next_tip = 44
-    self.next_mix_well = 38
-    #28-37
-    # 25-27(20251202)
-    # 15-24 ()
-    # 12-14 (20251126)    
-    # 8-10 (20251121)
-    # 7 (20251120)
-    # 6 (20251118)
-    # 0-5 (20251114)
-    # 84-88 (20251113)
-    # 89-95 (20251112)
-    self.plate_floor = 5
-    self.next_drop_well = 0
+  # Tip, mix well, drop well and hotel floor cursors live in the shared deck inventory
+  next_tip = inventory_property("next_tip")
+  next_mix_well = inventory_property("next_mix_well")
+  next_drop_well = inventory_property("next_drop_well")
+  plate_floor = inventory_property("plate_floor")
+
+  def __init__(self, simulate=False, timing=None, tracer=None, inventory=None, warm=False):
+    """
+    simulate: use a local stand-in backend that records operations and
+    estimates their duration from timing (see ot2_simulator.DEFAULT_TIMING)
+    tracer: tracing.Tracer recording every LiquidHandler call
+    inventory: DeckInventory shared with RoboticArm (default: inventory.DEFAULT_PATH,
+    or an in-memory one when simulating)
+    warm: skip homing when the last protocol finished cleanly
+    """
+    if inventory is None:
+      inventory = DeckInventory(None) if simulate else shared_inventory()
+    self.inventory = inventory
+    self.warm = warm
+    # pylabrobot is imported here, so importing this module (e.g. by main.py before the UI is up) stays fast
+    from pylabrobot.liquid_handling import LiquidHandler
+    from pylabrobot.resources import Coordinate
+    from pylabrobot.resources.opentrons import OTDeck
+    if simulate:
+      from ot2_simulator import SimulatedOpentronsBackend
+      backend = SimulatedOpentronsBackend(timing)
+    else:
+      from pylabrobot.liquid_handling.backends import OpentronsBackend
+      backend = OpentronsBackend(host="169.254.211.53")
+    self.lh = LiquidHandler(backend=backend, deck=OTDeck())
+    if tracer is not None:
+      self.lh = tracer.wrap(self.lh, "ot2")
 
     self.initial_water_well = 4
     
@@ -40,10 +46,39 @@ class OT2:
     self.offset12 = Coordinate(-1.7, -2.2, -17.0)
     self.offset96 = Coordinate(-0.5, -1.2, -17.0)
 
-    asyncio.run(self._setup())
+    # One event loop for the lifetime of the connection; protocols queue on it
+    self._loop = asyncio.new_event_loop()
+    self._loop_thread = threading.Thread(target=self._loop.run_forever, name="ot2-loop", daemon=True)
+    self._loop_thread.start()
+    self._lock = None
+
+    self._submit(self._setup()).result()
+
+  async def _exclusive(self, coro):
+    """Run coro once every earlier job has finished"""
+    if self._lock is None:
+      self._lock = asyncio.Lock()
+    async with self._lock:
+      return await coro
+
+  def _submit(self, coro):
+    """Queue coro on the OT-2 event loop; returns a concurrent.futures.Future"""
+    return asyncio.run_coroutine_threadsafe(self._exclusive(coro), self._loop)
+
+  def close(self):
+    self._submit(self.lh.stop()).result()
+    self._loop.call_soon_threadsafe(self._loop.stop)
+    self._loop_thread.join()
 
   def set_next_tip(self, num):
     self.next_tip = num
+
+  def new_plate(self, floor: int):
+    """
+    Start an empty drop plate taken from hotel floor
+    The next sample goes into its first drop well, and the arm images from its first well.
+    """
+    self.inventory.new_plate(floor)
   
   def _get_tip_spot_name(self, num):
     if num < 0 or num >= 96:
@@ -70,6 +105,7 @@ class OT2:
       return ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H'][num//12] + str(num%12 + 1)
   
   async def _auto_pick_up_tip(self):
+    from pylabrobot.resources import Coordinate
     if self.next_tip < 96:
       tip = self._get_tip_spot_name(self.next_tip)
       await self.lh.pick_up_tips(self.tip_rack1[tip],
@@ -81,8 +117,18 @@ class OT2:
     self.next_tip += 1
   
   async def _setup(self):
+    from pylabrobot.resources.opentrons import (
+      opentrons_96_tiprack_1000ul,
+      corning_12_wellplate_6point9ml_flat,
+      corning_6_wellplate_16point8ml_flat,
+      thermoscientificnunc_96_wellplate_1300ul
+    )
     await self.lh.setup()
-    await self.lh.backend.home()
+    if self.warm and self.inventory.state.get("ot2_clean"):
+      print("OT-2 warm restart: skip homing")
+    else:
+      await self.lh.backend.home()
+    self.inventory.set_state(ot2_clean=True)
     
     self.tip_rack1 = opentrons_96_tiprack_1000ul(name="tip_rack1")
     self.lh.deck.assign_child_at_slot(self.tip_rack1, slot=10)
@@ -102,100 +148,254 @@ class OT2:
     self.drop_plate = corning_6_wellplate_16point8ml_flat(name="drop_plate")
     self.lh.deck.assign_child_at_slot(self.drop_plate, slot=2)
 
+  def _surfactant_source(self, surf, wells):
+    """Stock well, transfer volume and pre-mix volume for a surfactant concentration"""
+    diluted_well, concentrated_well = wells
+    if surf < 0.01:
+      return diluted_well, surf*50000, 300
+    else:
+      return concentrated_well, surf*10000, 400
+
+  def _plan_single_sample(self, mix_well, drop_well, water_well, silica, PVA, SDS, DTAB, PVP):
+    """
+    Steps of the one-sample routine
+    Each step is (op, plate, well, volume, offset) with plate and offset
+    given as attribute names, so plans can be built and counted offline.
+    """
+    plan = []
+    water = 1000 - silica
+
+    # surfactants
+    Surfactants = [PVA, SDS, DTAB, PVP]
+    for surf, wells in zip(Surfactants, SURFACTANT_WELLS):
+      if surf > 0:
+        stock_well, volume, mix_volume = self._surfactant_source(surf, wells)
+        plan.append(("pick_up_tip", None, None, None, None))
+        for _ in range(3):
+          plan.append(("aspirate", "surfactant_plate", stock_well, mix_volume, "offset12"))
+          plan.append(("dispense", "surfactant_plate", stock_well, mix_volume, "offset12"))
+        plan.append(("aspirate", "surfactant_plate", stock_well, volume, "offset12"))
+        plan.append(("dispense", "mix_plate", mix_well, volume, "offset96"))
+        plan.append(("discard_tips", None, None, None, None))
+        water -= volume
+
+    # water
+    plan.append(("pick_up_tip", None, None, None, None))
+    plan.append(("aspirate", "silica_water_plate", water_well, water, "offset12"))
+    plan.append(("dispense", "mix_plate", mix_well, water, "offset96"))
+    plan.append(("discard_tips", None, None, None, None))
+
+    # silica
+    plan.append(("pick_up_tip", None, None, None, None))
+    for _ in range(3):
+      plan.append(("aspirate", "silica_water_plate", "A1", 200, "offset12"))
+      plan.append(("dispense", "silica_water_plate", "A1", 200, "offset12"))
+    plan += self._plan_silica_and_drop(mix_well, drop_well, silica)
+    plan.append(("home", None, None, None, None))
+    return plan
+
+  def _plan_silica_and_drop(self, mix_well, drop_well, silica):
+    """Add silica, mix and move the drop with the same tip"""
+    plan = []
+    plan.append(("aspirate", "silica_water_plate", "A1", silica, "offset12"))
+    plan.append(("dispense", "mix_plate", mix_well, silica, "offset96"))
+    for _ in range(2):
+      plan.append(("aspirate", "mix_plate", mix_well, 100, "offset96"))
+      plan.append(("dispense", "mix_plate", mix_well, 100, "offset96"))
+    plan.append(("aspirate", "mix_plate", mix_well, 100, "offset96"))
+    plan.append(("dispense", "drop_plate", drop_well, 100, "offset6"))
+    plan.append(("discard_tips", None, None, None, None))
+    return plan
+
+  def _plan_samples(self, samples):
+    """
+    Steps for a whole drop plate at once
+    samples: dicts with mix_well, drop_well, water_well and the five concentrations.
+    Water goes first into the still-empty mix wells, so one tip serves
+    every well. Each stock is pre-mixed once per batch, dispenses follow
+    mix-well order, and the robot homes once at the end.
+    """
+    plan = []
+    samples = sorted(samples, key=lambda sample: sample["mix_index"])
+
+    water = {}
+    for sample in samples:
+      water[sample["mix_well"]] = 1000 - sample["silica"]
+      for surf, wells in zip(self._surfactants(sample), SURFACTANT_WELLS):
+        if surf > 0:
+          water[sample["mix_well"]] -= self._surfactant_source(surf, wells)[1]
+
+    # water into empty wells: the tip never touches another reagent
+    plan.append(("pick_up_tip", None, None, None, None))
+    for sample in samples:
+      plan.append(("aspirate", "silica_water_plate", sample["water_well"], water[sample["mix_well"]], "offset12"))
+      plan.append(("dispense", "mix_plate", sample["mix_well"], water[sample["mix_well"]], "offset96"))
+    plan.append(("discard_tips", None, None, None, None))
+
+    # surfactants: pre-mix each stock once, then a fresh tip per (now wet) mix well
+    for i, wells in enumerate(SURFACTANT_WELLS):
+      mixed = set()
+      for sample in samples:
+        surf = self._surfactants(sample)[i]
+        if surf <= 0:
+          continue
+        stock_well, volume, mix_volume = self._surfactant_source(surf, wells)
+        plan.append(("pick_up_tip", None, None, None, None))
+        if stock_well not in mixed:
+          for _ in range(3):
+            plan.append(("aspirate", "surfactant_plate", stock_well, mix_volume, "offset12"))
+            plan.append(("dispense", "surfactant_plate", stock_well, mix_volume, "offset12"))
+          mixed.add(stock_well)
+        plan.append(("aspirate", "surfactant_plate", stock_well, volume, "offset12"))
+        plan.append(("dispense", "mix_plate", sample["mix_well"], volume, "offset96"))
+        plan.append(("discard_tips", None, None, None, None))
+
+    # silica: pre-mix once, then one tip per sample for silica, mixing and the drop
+    for j, sample in enumerate(samples):
+      plan.append(("pick_up_tip", None, None, None, None))
+      if j == 0:
+        for _ in range(3):
+          plan.append(("aspirate", "silica_water_plate", "A1", 200, "offset12"))
+          plan.append(("dispense", "silica_water_plate", "A1", 200, "offset12"))
+      plan += self._plan_silica_and_drop(sample["mix_well"], sample["drop_well"], sample["silica"])
+
+    plan.append(("home", None, None, None, None))
+    return plan
+
+  def _surfactants(self, sample):
+    return [sample["PVA"], sample["SDS"], sample["DTAB"], sample["PVP"]]
+
+  def _check_tips(self, plan):
+    """Refuse a plan before its first step if the tip racks can not cover it"""
+    needed = sum(op == "pick_up_tip" for op, *_ in plan)
+    if needed > self.inventory.remaining("next_tip"):
+      raise ValueError("The plan needs {} tips, only {} left".format(needed, self.inventory.remaining("next_tip")))
+
+  async def _run_plan(self, plan):
+    self._check_tips(plan)
+    # Cleared while a protocol runs, so a crash forces homing on the next start
+    self.inventory.set_state(ot2_clean=False)
+    await self._run_steps(plan)
+    self.inventory.set_state(ot2_clean=True)
+
+  async def _run_steps(self, plan):
+    for op, plate, well, volume, offset in plan:
+      if op == "pick_up_tip":
+        await self._auto_pick_up_tip()
+      elif op == "discard_tips":
+        await self.lh.discard_tips()
+      elif op == "home":
+        await self.lh.backend.home()
+      elif op == "aspirate":
+        await self.lh.aspirate(getattr(self, plate)[well], vols=[volume],
+                               offsets=[getattr(self, offset)])
+      elif op == "dispense":
+        await self.lh.dispense(getattr(self, plate)[well], vols=[volume],
+                               offsets=[getattr(self, offset)])
+      else:
+        raise ValueError("Unknown step: {}".format(op))
+
   async def _prepare_single_sample_async(self, silica: float, PVA: float, SDS: float, DTAB: float, PVP: float):
+      # Every check comes before the first well or tip is used
+      if self.inventory.remaining("next_drop_well") < 1:
+        raise ValueError("No drop wells left on the plate; start a new one with new_plate")
+      if self.inventory.remaining("next_mix_well") < 1:
+        raise ValueError("No mix wells left on the mix plate")
       mix_well = self._get_well_name96(self.next_mix_well)
-      self.next_mix_well += 1
       water_well = self._get_well_name12(self.next_drop_well//3+self.initial_water_well)
       # water_well = self._get_well_name12(self.plate_floor//3+self.initial_water_well)
-
-      water = 1000 - silica
-   
-      # surfactants
-      Surfactants = [PVA, SDS, DTAB, PVP]
-      well_names  = [("A1", "B1"), ("A2", "B2"), ("A3", "B3"), ("C4", "B4")]  
-      for surf, wells in zip(Surfactants, well_names):
-        diluted_well, concentrated_well = wells
-        if surf > 0: 
-          if surf < 0.01:
-            await self._auto_pick_up_tip()
-            for _ in range(3):
-                await self.lh.aspirate(self.surfactant_plate[diluted_well], vols=[300],
-                              offsets=[self.offset12])
-                await self.lh.dispense(self.surfactant_plate[diluted_well], vols=[300],
-                              offsets=[self.offset12])
-            await self.lh.aspirate(self.surfactant_plate[diluted_well], vols=[surf*50000],
-                              offsets=[self.offset12])
-            await self.lh.dispense(self.mix_plate[mix_well], vols=[surf*50000],
-                              offsets=[self.offset96])
-            await self.lh.discard_tips()
-            water -= surf*50000
-          
-          else: 
-            await self._auto_pick_up_tip()
-            for _ in range(3):
-                await self.lh.aspirate(self.surfactant_plate[concentrated_well], vols=[400],
-                              offsets=[self.offset12])
-                await self.lh.dispense(self.surfactant_plate[concentrated_well], vols=[400],
-                              offsets=[self.offset12])
-            await self.lh.aspirate(self.surfactant_plate[concentrated_well], vols=[surf*10000],
-                              offsets=[self.offset12])
-            await self.lh.dispense(self.mix_plate[mix_well], vols=[surf*10000],
-                              offsets=[self.offset96])
-            await self.lh.discard_tips()
-            water -= surf*10000
-
-      # water
-      await self._auto_pick_up_tip()
-      await self.lh.aspirate(self.silica_water_plate[water_well], vols=[water],
-                          offsets=[self.offset12])
-      await self.lh.dispense(self.mix_plate[mix_well], vols=[water],
-                          offsets=[self.offset96])
-      await self.lh.discard_tips()
-
-
-      # silica
-      await self._auto_pick_up_tip()
-      for _ in range(3):
-        await self.lh.aspirate(self.silica_water_plate["A1"], vols=[200],
-                               offsets=[self.offset12])
-        await self.lh.dispense(self.silica_water_plate["A1"], vols=[200],
-                               offsets=[self.offset12])
-      await self.lh.aspirate(self.silica_water_plate["A1"], vols=[silica],
-                         offsets=[self.offset12])
-      await self.lh.dispense(self.mix_plate[mix_well], vols=[silica],
-                         offsets=[self.offset96])
-       
-
       drop_well = self._get_well_name6(self.next_drop_well)
-      for _ in range(2):
-        await self.lh.aspirate(self.mix_plate[mix_well], vols=[100],
-                                offsets=[self.offset96])
-        await self.lh.dispense(self.mix_plate[mix_well], vols=[100],
-                                offsets=[self.offset96])
-      await self.lh.aspirate(self.mix_plate[mix_well], vols=[100],
-                            offsets=[self.offset96])
-      await self.lh.dispense(self.drop_plate[drop_well], vols=[100],
-                            offsets=[self.offset6])
+
+      plan = self._plan_single_sample(mix_well, drop_well, water_well, silica, PVA, SDS, DTAB, PVP)
+      self._check_tips(plan)
+      self.next_mix_well += 1
+      await self._run_plan(plan)
       self.next_drop_well += 1
-        
-      await self.lh.discard_tips()
-      await self.lh.backend.home()
+
+  def _allocate_samples(self, compositions):
+    """Assign mix, drop and water wells to each composition without consuming them"""
+    if self.next_drop_well + len(compositions) > 6:
+      raise ValueError("Only {} drop wells left on the plate; start a new one with new_plate".format(
+        6 - self.next_drop_well))
+    if len(compositions) > self.inventory.remaining("next_mix_well"):
+      raise ValueError("Only {} mix wells left on the mix plate".format(self.inventory.remaining("next_mix_well")))
+
+    samples = []
+    for i, composition in enumerate(compositions):
+      if not isinstance(composition, dict):
+        pva, pvp = composition
+        composition = {"pva": pva, "pvp": pvp}
+      drop_index = self.next_drop_well + i
+      samples.append({
+        "mix_index": self.next_mix_well + i,
+        "mix_well": self._get_well_name96(self.next_mix_well + i),
+        "drop_well": self._get_well_name6(drop_index),
+        "water_well": self._get_well_name12(drop_index//3+self.initial_water_well),
+        "silica": composition.get("silica", 100),
+        "PVA": composition.get("pva", 0),
+        "SDS": composition.get("sds", 0),
+        "DTAB": composition.get("dtab", 0),
+        "PVP": composition.get("pvp", 0),
+      })
+    return samples
+
+  def plan_samples(self, compositions: list) -> dict:
+    """
+    Compare the batched plan with running prepare_single_sample for each composition
+    Return value: tips and moves (aspirate, dispense and home) of both plans.
+    """
+    samples = self._allocate_samples(compositions)
+    single = []
+    for sample in samples:
+      single += self._plan_single_sample(sample["mix_well"], sample["drop_well"], sample["water_well"],
+                                         sample["silica"], *self._surfactants(sample))
+    batched = self._plan_samples(samples)
+
+    def count(plan):
+      tips = sum(op == "pick_up_tip" for op, *_ in plan)
+      moves = sum(op in ("aspirate", "dispense", "home") for op, *_ in plan)
+      return tips, moves
+    single_tips, single_moves = count(single)
+    batched_tips, batched_moves = count(batched)
+    return {
+      "tips": batched_tips, "tips_saved": single_tips - batched_tips,
+      "moves": batched_moves, "moves_saved": single_moves - batched_moves,
+    }
 
   def prepare_single_sample(self, pva: float, pvp: float):
+    self.submit_single_sample(pva, pvp).result()
+
+  def submit_single_sample(self, pva, pvp):
+    """
+    Queue prepare_single_sample without waiting
+    Return value: concurrent.futures.Future that completes when the sample is in the drop plate.
+    """
     silica = 100
     dtab = 0
     sds = 0
+    return self._submit(self._prepare_single_sample_async(silica, pva, sds, dtab, pvp))
 
-    # try:
-    #   loop = asyncio.get_running_loop()
-    # except RuntimeError:
-    #   loop = None
-    
-    # if loop and loop.is_running():
-    #   with ThreadPoolExecutor() as pool:
-    #     pool.submit(asyncio.run, self._prepare_single_sample_async(silica, pva, sds, dtab, pvp)).result()
-    # else:
-    asyncio.run(self._prepare_single_sample_async(silica, pva, sds, dtab, pvp))
+  def prepare_samples(self, compositions: list) -> dict:
+    """
+    Prepare up to six samples into the drop plate as one protocol
+    compositions: (pva, pvp) pairs, or dicts with any of silica, pva, sds, dtab and pvp
+    Return value: tips and moves used, and saved against per-sample preparation.
+    """
+    return self.submit_samples(compositions).result()
+
+  def submit_samples(self, compositions):
+    """Queue prepare_samples without waiting; returns a Future of its report"""
+    return self._submit(self._prepare_samples_async(compositions))
+
+  async def _prepare_samples_async(self, compositions):
+    # Wells are allocated when the job runs, so queued jobs never collide
+    report = self.plan_samples(compositions)
+    samples = self._allocate_samples(compositions)
+    await self._run_plan(self._plan_samples(samples))
+    self.next_mix_well += len(samples)
+    self.next_drop_well += len(samples)
+    print("tips: {tips} ({tips_saved} saved), moves: {moves} ({moves_saved} saved)".format(**report))
+    return report
 
 if __name__ == "__main__":
   lh = OT2()
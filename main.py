@@ -1,12 +1,27 @@
+import argparse
+
 import ivoryos
 
 from robotic_arm import RoboticArm
 from liquid_handler import OT2
+from devices import Readiness, deferred
+from jobs import JobServer
+
+# The robots connect and home on first use (or in the warm-up below), so the UI comes up at once
+lh = deferred(OT2)
+arm = deferred(RoboticArm)
+# readiness.status(): "pending", "starting", "ready" or "failed" per device, and the FastSAM worker
+readiness = Readiness(ot2=lh, arm=arm)
+# Non-blocking access: jobs.submit("arm", "heat_plate", '{"debug": false}'), then status/result/cancel
+jobs = JobServer(ot2=lh, arm=arm)
 
-lh = OT2()
-arm = RoboticArm()
-    
 if __name__ == "__main__":
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--no-warm-up", action="store_true",
+                      help="connect the robots only when a workflow first uses them")
+  args = parser.parse_args()
+  if not args.no_warm_up:
+    readiness.warm_up()
   ivoryos.run(__name__, port=8888)
   # # x1 = 0
   # # x2 = 0
@@ -18,3 +33,9 @@ if __name__ == "__main__":
   #   arm.heat_plate(debug=False)
   #   sdl.measure_results()
   #   arm.place_plate()
+  # # Batch mode: six compositions per plate, one heating cycle
+  # from batch_selection import run_batch_cycle
+  # from experiment_store import ExperimentStore
+  # store = ExperimentStore()
+  # for _ in range(6):
+  #   run_batch_cycle(store, lh, arm, k=6)
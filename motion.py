@@ -0,0 +1,168 @@
+import math
+
+AXES = ("x", "y", "z", "roll", "pitch", "yaw")
+
+
+class Waypoint:
+  """
+  Target for some axes of the TCP pose; the others keep their current value
+  stop: come to rest here (approach/retreat legs near the gripper, the
+  hotel and the hotplate). Other waypoints are blended with a corner radius.
+  """
+  def __init__(self, speed, stop=False, **axes):
+    unknown = set(axes) - set(AXES)
+    if unknown:
+      raise ValueError("Unknown axes: {}".format(sorted(unknown)))
+    self.speed = speed
+    self.stop = stop
+    self.axes = axes
+
+  def __repr__(self):
+    return "Waypoint(speed={}, stop={}, {})".format(self.speed, self.stop, self.axes)
+
+
+def pose_axes(pose, *axes):
+  """Pick axes out of a [x, y, z, roll, pitch, yaw] pose for a Waypoint"""
+  return {axis: pose[AXES.index(axis)] for axis in axes}
+
+
+def compile_motion(start, sequence, radius=20.0):
+  """
+  Turn a routine into set_position commands
+  sequence: Waypoints and arm method names (e.g. "close_bio_gripper"),
+  which are called with the arm at rest.
+  radius: blend radius in mm for transit waypoints; None stops at every one.
+  Return value: ("move", pose, speed, radius, wait) and ("call", name) tuples.
+  """
+  poses = []
+  pose = list(start)
+  for item in sequence:
+    if isinstance(item, Waypoint):
+      for axis, value in item.axes.items():
+        pose[AXES.index(axis)] = value
+      poses.append(list(pose))
+    else:
+      poses.append(None)
+
+  commands = []
+  previous = list(start)
+  for i, item in enumerate(sequence):
+    if not isinstance(item, Waypoint):
+      commands.append(("call", item))
+      continue
+    following = sequence[i+1] if i + 1 < len(sequence) else None
+    stop = radius is None or item.stop or not isinstance(following, Waypoint)
+    if stop:
+      commands.append(("move", poses[i], item.speed, None, True))
+    else:
+      # A corner can not be rounded by more than half of either adjacent segment
+      blend = min(radius, 0.5*_distance(previous, poses[i]), 0.5*_distance(poses[i], poses[i+1]))
+      commands.append(("move", poses[i], item.speed, blend, False))
+    previous = poses[i]
+  return commands
+
+
+def run_motion(arm, sequence, radius=20.0):
+  """Compile sequence from the arm's current pose and send it"""
+  for command in compile_motion(arm.position, sequence, radius):
+    if command[0] == "call":
+      getattr(arm, command[1])()
+    else:
+      _, pose, speed, blend, wait = command
+      arm.set_position(*pose, speed=speed, radius=blend, wait=wait)
+
+
+def _distance(a, b):
+  return math.dist(a[:3], b[:3])
+
+
+class MockXArmAPI:
+  """
+  Stand-in for xarm.wrapper.XArmAPI that records commanded paths
+  Cycle time is estimated from path length and speed, plus an
+  acceleration/deceleration and settle penalty at every stop point.
+  """
+  def __init__(self, port=None, home=(207.0, 0.0, 112.0, 180, 0, 0),
+               acceleration=500.0, settle=0.2, angular_speed=90.0, gripper_time=1.5):
+    self.home = list(home)
+    self.position = list(home)
+    self.acceleration = acceleration
+    self.settle = settle
+    self.angular_speed = angular_speed
+    self.gripper_time = gripper_time
+    self.path = []
+    self.cycle_time = 0.0
+    self.stops = 0
+
+  def set_position(self, x=None, y=None, z=None, roll=None, pitch=None, yaw=None,
+                   radius=None, speed=None, wait=False, **kwargs):
+    target = [current if value is None else value
+              for current, value in zip(self.position, (x, y, z, roll, pitch, yaw))]
+    speed = speed or 100
+    distance = _distance(self.position, target)
+    rotation = max(abs(a - b) for a, b in zip(self.position[3:], target[3:]))
+    seconds = max(distance / speed, rotation / self.angular_speed)
+    stop = radius is None or radius < 0
+    if stop:
+      seconds += speed / self.acceleration + self.settle
+      self.stops += 1
+    self.cycle_time += seconds
+    self.path.append({"pose": target, "speed": speed, "radius": radius, "wait": wait, "seconds": seconds})
+    self.position = target
+    return 0
+
+  def get_position(self, is_radian=None):
+    return 0, list(self.position)
+
+  def move_gohome(self, wait=False, **kwargs):
+    return self.set_position(*self.home, speed=100, wait=wait)
+
+  def open_bio_gripper(self, **kwargs):
+    self.cycle_time += self.gripper_time
+    return 0
+
+  def close_bio_gripper(self, **kwargs):
+    self.cycle_time += self.gripper_time
+    return 0
+
+  def reset(self, wait=False, **kwargs):
+    self.position = list(self.home)
+    return 0
+
+  def motion_enable(self, *args, **kwargs):
+    return 0
+
+  def set_mode(self, *args, **kwargs):
+    return 0
+
+  def set_state(self, *args, **kwargs):
+    return 0
+
+  def set_bio_gripper_enable(self, *args, **kwargs):
+    return 0
+
+
+def estimate_cycle_times(radii=(None, 20.0)):
+  """
+  Run one plate cycle of RoboticArm on MockXArmAPI for each blend radius
+  Return value: {radius: (estimated seconds, stop points)}
+  """
+  from robotic_arm import RoboticArm
+
+  estimates = {}
+  for radius in radii:
+    robot = RoboticArm(simulate=True)
+    robot.blend_radius = radius
+    robot.arm.cycle_time = 0.0
+    robot.arm.stops = 0
+    robot.load_plate()
+    robot.heat_plate()
+    robot._prepare_plate_image()
+    robot.place_plate()
+    estimates[radius] = (robot.arm.cycle_time, robot.arm.stops)
+  return estimates
+
+
+if __name__ == "__main__":
+  for radius, (seconds, stops) in estimate_cycle_times().items():
+    print("blend radius {}: {:.1f} s, {} stop points".format(radius, seconds, stops))
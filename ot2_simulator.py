@@ -0,0 +1,130 @@
+import argparse
+import math
+
+try:
+  from pylabrobot.liquid_handling.backends import LiquidHandlerChatterboxBackend
+except ImportError:
+  from pylabrobot.liquid_handling.backends import ChatterBoxBackend as LiquidHandlerChatterboxBackend
+
+# Seconds per operation, per mm of head travel and per uL pipetted.
+# Travel goes up to safe_z, across and back down, as the OT-2 does.
+DEFAULT_TIMING = {
+  "pick_up_tip": 5.0,
+  "drop_tip": 4.0,
+  "aspirate": 2.0,
+  "dispense": 2.0,
+  "home": 12.0,
+  "per_mm": 0.008,
+  "per_uL": 0.004,
+  "safe_z": 150.0,
+}
+
+HOME_POSITION = (420.0, 350.0, 200.0)
+
+
+class SimulatedOpentronsBackend(LiquidHandlerChatterboxBackend):
+  """
+  Stand-in for OpentronsBackend that records every operation
+  Wall-clock time is estimated from the timing model instead of waiting.
+  """
+  def __init__(self, timing=None):
+    super().__init__()
+    self.timing = dict(DEFAULT_TIMING, **(timing or {}))
+    self.log = []
+    self._position = HOME_POSITION
+
+  def _travel(self, target):
+    x0, y0, z0 = self._position
+    x1, y1, z1 = target
+    safe_z = max(self.timing["safe_z"], z0, z1)
+    distance = (safe_z - z0) + math.hypot(x1 - x0, y1 - y0) + (safe_z - z1)
+    self._position = target
+    return distance
+
+  def _record(self, op, ops=None, volume=None):
+    name, distance = None, 0.0
+    if ops:
+      resource = ops[0].resource
+      location = resource.get_absolute_location() + ops[0].offset
+      name = resource.name
+      distance = self._travel((location.x, location.y, location.z))
+    elif op == "home":
+      distance = self._travel(HOME_POSITION)
+
+    seconds = self.timing[op] + distance*self.timing["per_mm"]
+    if volume is not None:
+      seconds += volume*self.timing["per_uL"]
+    self.log.append({"op": op, "resource": name, "volume": volume,
+                     "travel_mm": distance, "seconds": seconds})
+
+  async def pick_up_tips(self, ops, use_channels, **backend_kwargs):
+    await super().pick_up_tips(ops, use_channels, **backend_kwargs)
+    self._record("pick_up_tip", ops)
+
+  async def drop_tips(self, ops, use_channels, **backend_kwargs):
+    await super().drop_tips(ops, use_channels, **backend_kwargs)
+    self._record("drop_tip", ops)
+
+  async def aspirate(self, ops, use_channels, **backend_kwargs):
+    await super().aspirate(ops, use_channels, **backend_kwargs)
+    self._record("aspirate", ops, sum(op.volume for op in ops))
+
+  async def dispense(self, ops, use_channels, **backend_kwargs):
+    await super().dispense(ops, use_channels, **backend_kwargs)
+    self._record("dispense", ops, sum(op.volume for op in ops))
+
+  async def home(self):
+    self._record("home")
+
+  def estimated_time(self):
+    return sum(entry["seconds"] for entry in self.log)
+
+  def summary(self):
+    """Operation counts, travel and estimated seconds of everything recorded"""
+    counts = {}
+    for entry in self.log:
+      counts[entry["op"]] = counts.get(entry["op"], 0) + 1
+    return {
+      "operations": counts,
+      "travel_mm": sum(entry["travel_mm"] for entry in self.log),
+      "seconds": self.estimated_time(),
+    }
+
+  def reset_log(self):
+    self.log = []
+
+
+def simulate_protocol(compositions, batched=False, timing=None):
+  """
+  Replay the preparation of compositions on a simulated OT-2
+  batched selects OT2.prepare_samples instead of prepare_single_sample per sample.
+  Return value: the backend summary plus projected samples per hour.
+  """
+  from liquid_handler import OT2
+
+  ot2 = OT2(simulate=True, timing=timing)
+  ot2.set_next_tip(0)
+  ot2.lh.backend.reset_log()
+  if batched:
+    ot2.prepare_samples(compositions)
+  else:
+    for pva, pvp in compositions:
+      ot2.prepare_single_sample(pva, pvp)
+
+  summary = ot2.lh.backend.summary()
+  summary["samples_per_hour"] = 3600 * len(compositions) / summary["seconds"]
+  return summary
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Estimate OT-2 protocol time without the robot")
+  parser.add_argument("--pva", type=float, nargs="+", default=[0.02, 0.005, 0.03, 0.0, 0.01, 0.02])
+  parser.add_argument("--pvp", type=float, nargs="+", default=[0.0, 0.0, 0.002, 0.0, 0.01, 0.0])
+  args = parser.parse_args()
+
+  compositions = list(zip(args.pva, args.pvp))
+  for batched in (False, True):
+    summary = simulate_protocol(compositions, batched=batched)
+    print("{}: {:.0f} s, {:.0f} mm travel, {:.1f} samples/h, {}".format(
+      "batched" if batched else "per-sample", summary["seconds"], summary["travel_mm"],
+      summary["samples_per_hour"], summary["operations"]))
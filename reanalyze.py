@@ -0,0 +1,128 @@
+import argparse
+import csv
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from evaluation import find_raw_images, load_summary
+
+FIELDS = ["No", "PVA (%)", "DTAB (%)", "image", "ratio", "tier", "result (auto)", "result (human)", "seconds"]
+
+_model = None
+_mode = None
+_artifacts = None
+_cache = None
+_geometry = None
+
+def _init_worker(weights, mode, artifacts, threads, cache_path=None, inference="default", geometry_path=None):
+    global _model, _mode, _artifacts, _cache, _geometry
+    from inference import configure_inference
+    configure_inference(inference, threads=threads)
+    from image_analysis import load_fastsam
+    _model = load_fastsam(weights)
+    _mode = mode
+    _artifacts = artifacts
+    if cache_path:
+        from analysis_cache import AnalysisCache
+        _cache = AnalysisCache(cache_path, weights)
+    if geometry_path:
+        from well_geometry import WellGeometry
+        # Read-only: the workers would race on the file
+        _geometry = WellGeometry(geometry_path, learn=False)
+
+def _analyze(path):
+    from image_analysis import detect_coffee_ring, detect_coffee_ring_tiered
+
+    start = time.perf_counter()
+    if _mode == "tiered":
+        ratio, tier = detect_coffee_ring_tiered(_model, path, os.path.dirname(path), artifacts=_artifacts,
+                                                 cache=_cache, geometry=_geometry)
+    else:
+        ratio, tier = detect_coffee_ring(_model, path, os.path.dirname(path), artifacts=_artifacts,
+                                         cache=_cache, geometry=_geometry), "fastsam"
+    return path, float(ratio), tier, time.perf_counter() - start
+
+def _done_images(output):
+    if not os.path.exists(output):
+        return set()
+    with open(output, newline="", encoding="utf-8-sig") as f:
+        return {row["image"] for row in csv.DictReader(f)}
+
+def _row(results_dir, summary, path, ratio, tier, seconds):
+    from image_analysis import RING_RATIO_THRESHOLD
+
+    match = re.search(r"experiment(\d+)$", os.path.dirname(path))
+    no = int(match.group(1)) if match else ""
+    known = summary.get(no, {})
+    return {
+        "No": no,
+        "PVA (%)": known.get("PVA (%)", ""),
+        "DTAB (%)": known.get("DTAB (%)", ""),
+        "image": os.path.relpath(path, results_dir).replace(os.sep, "/"),
+        "ratio": "{:.4f}".format(ratio),
+        "tier": tier,
+        "result (auto)": int(ratio > RING_RATIO_THRESHOLD),
+        "result (human)": known.get("result (human)", ""),
+        "seconds": "{:.3f}".format(seconds),
+    }
+
+def reanalyze(results_dir="results", output=None, workers=None, mode="fastsam",
+              weights="FastSAM/weights/FastSAM-x.pt", artifacts="none", cache=None, inference="default",
+              geometry=None):
+    """Analyze every raw image not yet in output and append its row.
+    cache: path of an AnalysisCache database shared by the workers.
+    geometry: path of a WellGeometry file, used read-only.
+    inference: "default" or "cpu" (see inference.configure_inference).
+    """
+    if output is None:
+        output = os.path.join(results_dir, "results_summary_reanalysis.csv")
+    if workers is None:
+        workers = os.cpu_count() or 1
+    threads = max(1, (os.cpu_count() or 1) // workers)
+
+    summary_path = os.path.join(results_dir, "results_summary.csv")
+    summary = load_summary(summary_path) if os.path.exists(summary_path) else {}
+    done = _done_images(output)
+    todo = [p for p in find_raw_images(results_dir)
+            if os.path.relpath(p, results_dir).replace(os.sep, "/") not in done]
+    print("{} images to analyze, {} already done".format(len(todo), len(done)))
+
+    new_file = not os.path.exists(output)
+    with open(output, "a", newline="", encoding="utf-8") as f, \
+         ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(weights, mode, artifacts, threads, cache, inference, geometry)) as pool:
+        writer = csv.DictWriter(f, fieldnames=FIELDS)
+        if new_file:
+            writer.writeheader()
+        futures = [pool.submit(_analyze, path) for path in todo]
+        for future in as_completed(futures):
+            row = _row(results_dir, summary, *future.result())
+            writer.writerow(row)
+            f.flush()
+            print("{image}: ratio {ratio} ({tier}, {seconds} s)".format(**row))
+
+    # Rewrite in experiment order once everything is in
+    with open(output, newline="", encoding="utf-8") as f:
+        rows = sorted(csv.DictReader(f), key=lambda row: row["image"])
+    with open(output, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+    return output
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-score raw well images in parallel")
+    parser.add_argument("--results", default="results")
+    parser.add_argument("--output", default=None,
+                        help="CSV to write (default: <results>/results_summary_reanalysis.csv)")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--mode", choices=["fastsam", "tiered"], default="fastsam")
+    parser.add_argument("--weights", default="FastSAM/weights/FastSAM-x.pt")
+    parser.add_argument("--artifacts", choices=["none", "summary", "full"], default="none")
+    parser.add_argument("--cache", default=None, help="AnalysisCache database, e.g. analysis_cache.sqlite")
+    parser.add_argument("--inference", choices=["default", "cpu"], default="default")
+    parser.add_argument("--geometry", default=None, help="WellGeometry file, e.g. well_geometry.json")
+    args = parser.parse_args()
+    reanalyze(args.results, args.output, args.workers, args.mode, args.weights, args.artifacts, args.cache,
+              args.inference, args.geometry)
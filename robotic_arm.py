@@ -1,27 +1,66 @@
 import os
-import time
 import shutil
 import sys
+import tempfile
 
+from concurrent.futures import Future
 from datetime import datetime
 
-import cv2
-import pyvisa
-from xarm.wrapper import XArmAPI
+import numpy as np
 
-from image_analysis import detect_coffee_ring
-
-sys.path.append("FastSAM")
-from fastsam import FastSAM
+from analysis_worker import AnalysisWorker, chain_future, gather_futures
+from heating import HeatingController
+from inventory import DeckInventory, inventory_property, shared_inventory
+from jobs import report_progress
+from motion import AXES, MockXArmAPI, Waypoint, pose_axes, run_motion
 
 
 class RoboticArm:
-  def __init__(self):
-    self.arm = XArmAPI("169.254.211.213")
-
-    self.rm = pyvisa.ResourceManager()
+  # Hotel floor and imaged well cursors live in the deck inventory shared with OT2
+  plate_floor = inventory_property("plate_floor")
+  next_drop_well = inventory_property("next_image_well")
+
+  def __init__(self, artifacts="full", analysis_mode="fastsam", simulate=False,
+               analysis_cache=os.path.join(os.path.dirname(__file__), "analysis_cache.sqlite"), tracer=None,
+               inventory=None, warm=False, inference="default",
+               well_geometry=os.path.join(os.path.dirname(__file__), "well_geometry.json")):
+    """
+    simulate: drive a MockXArmAPI that records paths and estimates cycle
+    time instead of the arm; the hotplate and analysis worker are skipped,
+    so measurements come back as None
+    analysis_cache: AnalysisCache database so re-analyzed frames are not segmented again; None disables it
+    tracer: tracing.Tracer recording arm moves, hotplate commands, camera reads and analysis stages
+    inventory: DeckInventory shared with OT2 (default: inventory.DEFAULT_PATH, in memory when simulating)
+    inference: "default" or "cpu" FastSAM settings of the analysis worker (see inference.py)
+    well_geometry: WellGeometry file of the well circles learned from past detections;
+    the Hough search stays near them. None disables it
+    warm: skip reset and homing when the arm is known to be at home without errors,
+    and keep writing into the previous result directory
+    """
+    if inventory is None:
+      inventory = DeckInventory(None) if simulate else shared_inventory()
+    self.inventory = inventory
+    self.simulate = simulate
+    self.tracer = tracer
+    if simulate:
+      self.arm = MockXArmAPI()
+      self.rm = None
+    else:
+      # Imported here so simulations and analysis-only sessions never load the hardware stacks
+      import pyvisa
+      from xarm.wrapper import XArmAPI
+      self.arm = XArmAPI("169.254.211.213")
+      self.rm = pyvisa.ResourceManager()
+    if tracer is not None:
+      self.arm = tracer.wrap(self.arm, "xarm")
     self.hotplate_path = 'ASRL5::INSTR'
-    print(self.rm.list_resources(), file=sys.stderr)
+    self._hotplate = None
+    # Heating stops once the drops are dry; max seconds stays as the cap.
+    # heating_frame_source: callable returning frames of the drops (see heating.camera_frame_source)
+    self.heating_max_seconds = 3600
+    self.heating_frame_source = None
+    if self.rm is not None:
+      print(self.rm.list_resources(), file=sys.stderr)
     
     self.plate_hotel_standard_position = [493.5, -110.0, 136.4, 180, 0, 0] #(20260408)
     self.plate_hotel1_z_floor_position = [405.0, -216.5, 46.0, 180, 0, 0] #(20260406)
@@ -38,138 +77,258 @@ class RoboticArm:
     self.center_photo_position = [-91.35, -380.6, 30.0, 180, 0, -90] #(20260408)
     self.A1_photo_position = [-71.8, -341.5, 8.0, 180, 0, -90] #(20260408)
 
-    self.plate_floor = 5
-    self.next_drop_well = 0
+    self.hotel_floor_positions = [self._hotel_floor_position(floor) for floor in range(12)]
+    # Corner radius (mm) for transit waypoints; None stops at every waypoint
+    self.blend_radius = 20.0
+
+    # Camera session shared by the wells of image_plate; stale frames flushed per capture
+    self._camera = None
+    self.camera_flush = 5
 
     self.arm.motion_enable(enable=True)
     self.arm.set_mode(0)
     self.arm.set_state(state=0)
 
-    self.arm.reset(wait=True)
     self.arm.set_bio_gripper_enable(True)
-    self.arm.move_gohome(wait=True)
-    self.arm.open_bio_gripper()
+    if warm and self.inventory.state.get("arm_home") and not getattr(self.arm, "has_err_warn", False):
+      print("xArm warm restart: skip reset and homing")
+    else:
+      self.arm.reset(wait=True)
+      self.arm.move_gohome(wait=True)
+      self.arm.open_bio_gripper()
+      self.inventory.set_state(arm_home=True)
 
     # Prepare working directory
-    self.result_path = os.path.join(os.path.dirname(__file__), datetime.now().strftime("%Y%m%d_%H%M"))
-    os.makedirs(self.result_path)
+    self.result_path = self.inventory.state.get("result_path") if warm else None
+    if simulate:
+      # Simulated runs never leave result directories in the repository
+      self.result_path = tempfile.mkdtemp(prefix="robotic_arm_simulate_")
+    elif not self.result_path:
+      self.result_path = os.path.join(os.path.dirname(__file__), datetime.now().strftime("%Y%m%d_%H%M"))
+    os.makedirs(self.result_path, exist_ok=True)
+    if not simulate:
+      self.inventory.set_state(result_path=self.result_path)
    
-    # Load FastSAM model
-    self.fastsam_model = FastSAM("FastSAM/weights/FastSAM-x.pt")
-
-  def load_plate(self):
+    # FastSAM is loaded once in a separate worker process; analysis results come back as futures
+    # "fastsam" segments every well; "tiered" tries the classical fast path first
+    self.analysis = None
+    if not simulate:
+      self.analysis = AnalysisWorker("FastSAM/weights/FastSAM-x.pt", analysis_mode=analysis_mode, artifacts=artifacts,
+                                     cache=analysis_cache, tracer=tracer, inference=inference,
+                                     geometry=well_geometry)
+
+  def _hotel_floor_position(self, floor):
+    if floor // 6 == 0:
+      x, y, z, roll, pitch, yaw = self.plate_hotel1_z_floor_position
+    else:
+      x, y, z, roll, pitch, yaw = self.plate_hotel2_z_floor_position
+    return [x, y, z + 45.2*(floor % 6), roll, pitch, yaw]
+
+  def _move(self, sequence):
+    self.inventory.set_state(arm_home=False)
+    run_motion(self.arm, sequence, self.blend_radius)
+    if sequence and sequence[-1] == "move_gohome":
+      self.inventory.set_state(arm_home=True)
+
+  def _go_home(self):
+    """Lift to the transit height, e.g. out of an open gripper at the hotplate, then home"""
+    self._move([
+      Waypoint(25, stop=True, **pose_axes(self.arm_position1, "z")),
+      "move_gohome",
+    ])
+
+  def load_plate(self, floor=None):
     """
     Load well plate from plate hotel to OT-2
+    floor: hotel floor of the plate (default: plate_floor)
     """
-    x, y, z, roll, pitch, yaw = self.plate_hotel_standard_position
-    self.arm.set_position(x=x, y=y, z=z, speed=80, wait=True)
-
-    assert(self.plate_floor >= 0)
-
-    if self.plate_floor // 6 == 0:
-        x, y, z, roll, pitch, yaw = self.plate_hotel1_z_floor_position
-    else:
-        x, y, z, roll, pitch, yaw = self.plate_hotel2_z_floor_position
-
-    z += 45.2*(self.plate_floor % 6)
-    self.arm.set_position(x=x, z=z, speed=80, wait=True)
-    self.arm.set_position(y=y, speed=80, wait=True)
-    self.arm.close_bio_gripper()
-    self.arm.set_position(z=z+10, speed=25, wait=True)
-
-    x, y, z, roll, pitch, yaw = self.plate_hotel_standard_position
-    self.arm.set_position(y=y, speed=80, wait=True)
-    self.arm.set_position(x=x, z=z, speed=80, wait=True)
-
-    x, y, z, roll, pitch, yaw = self.arm_position1
-    self.arm.set_position(x=x, y=y, yaw=yaw, speed=80, wait=True)
-    
-    x, y, z, roll, pitch, yaw = self.OT2_deck2_position
-    self.arm.set_position(x=x, y=y, speed=80, wait=True)
-    self.arm.set_position(z=z, speed=50, wait=True)
-    self.arm.open_bio_gripper()
-
-    x, y, z, roll, pitch, yaw = self.arm_position1
-    self.arm.set_position(z=z, speed=50, wait=True)
-    self.arm.set_position(x=x, speed=80, wait=True)
+    floor = self.plate_floor if floor is None else floor
+    assert(floor >= 0)
+    hotel = self.plate_hotel_standard_position
+    x, y, z, roll, pitch, yaw = self.hotel_floor_positions[floor]
+
+    self._move([
+      Waypoint(80, **pose_axes(hotel, "x", "y", "z")),
+      Waypoint(80, stop=True, x=x, z=z),
+      Waypoint(80, stop=True, y=y),
+      "close_bio_gripper",
+      Waypoint(25, stop=True, z=z+10),
+      Waypoint(80, stop=True, **pose_axes(hotel, "y")),
+      Waypoint(80, **pose_axes(hotel, "x", "z")),
+      Waypoint(80, **pose_axes(self.arm_position1, "x", "y", "yaw")),
+      Waypoint(80, stop=True, **pose_axes(self.OT2_deck2_position, "x", "y")),
+      Waypoint(50, stop=True, **pose_axes(self.OT2_deck2_position, "z")),
+      "open_bio_gripper",
+      Waypoint(50, stop=True, **pose_axes(self.arm_position1, "z")),
+      Waypoint(80, **pose_axes(self.arm_position1, "x")),
+    ])
+
+  def new_plate(self, floor: int):
+    """
+    Start an empty drop plate taken from hotel floor
+    load_plate and place_plate use that floor, and imaging starts again from well A1.
+    """
+    self.inventory.new_plate(floor)
 
   def heat_plate(self, debug=True):
     """
     Heat well plate using heat plate
     """
-    # Take well plate from OT-2
-    x, y, z, roll, pitch, yaw = self.OT2_deck2_position
-    self.arm.set_position(x=x, speed=80, wait=True)
-    self.arm.set_position(z=z, speed=50, wait=True)
-    self.arm.close_bio_gripper()
-
-    x, y, z, roll, pitch, yaw = self.arm_position1
-    self.arm.set_position(z=z, speed=25, wait=True)
-           
-    # Place the well plate on heat plate
-    x, y, z, roll, pitch, yaw = self.hot_plate_position
-    self.arm.set_position(x=x, speed=40, wait=True)
-    self.arm.set_position(y=y, speed=40, wait=True)
-    self.arm.set_position(z=z, speed=10, wait=True)
-
-    self.arm.open_bio_gripper()
-    with self.rm.open_resource(self.hotplate_path) as hotplate:
-      hotplate.write('OUT_SP_1 60')
-      hotplate.write('START_1')
-      print("start heating at", datetime.now().strftime("%H:%M:%S"))
-      if debug:
-        time.sleep(5)
-      else:
-        time.sleep(3600)
-      print("finish heating at", datetime.now().strftime("%H:%M:%S"))
-      hotplate.write('STOP_1')
+    self._transfer_to_hotplate()
+    self._heat(debug)
+
+  def _transfer_to_hotplate(self):
+    """
+    Move well plate from OT-2 to heat plate
+    """
+    self._move([
+      # Take well plate from OT-2; y too, in case the arm comes from elsewhere than load_plate
+      Waypoint(80, stop=True, **pose_axes(self.OT2_deck2_position, "x", "y")),
+      Waypoint(50, stop=True, **pose_axes(self.OT2_deck2_position, "z")),
+      "close_bio_gripper",
+      Waypoint(25, stop=True, **pose_axes(self.arm_position1, "z")),
+      # Place the well plate on heat plate
+      Waypoint(40, **pose_axes(self.hot_plate_position, "x")),
+      Waypoint(40, stop=True, **pose_axes(self.hot_plate_position, "y")),
+      Waypoint(10, stop=True, **pose_axes(self.hot_plate_position, "z")),
+      "open_bio_gripper",
+    ])
+
+  def _hotplate_session(self):
+    """VISA session to the hotplate, opened on first use and kept open"""
+    if self._hotplate is None:
+      self._hotplate = self.rm.open_resource(self.hotplate_path)
+      if self.tracer is not None:
+        self._hotplate = self.tracer.wrap(self._hotplate, "hotplate")
+    return self._hotplate
+
+  def _heat(self, debug=True, floor=None):
+    """floor: hotel floor of the plate, for the timeline file name (default: plate_floor)"""
+    floor = self.plate_floor if floor is None else floor
+    if self.rm is None:
+      print("simulated: skip heating")
+      return
+
+    if debug:
+      controller = HeatingController(self._hotplate_session(), max_seconds=5, min_seconds=0, poll=1)
+    else:
+      controller = HeatingController(self._hotplate_session(), max_seconds=self.heating_max_seconds,
+                                     frame_source=self.heating_frame_source)
+    print("start heating at", datetime.now().strftime("%H:%M:%S"))
+    seconds, reason = controller.run()
+    print("finish heating at", datetime.now().strftime("%H:%M:%S"), "({:.0f} s, {})".format(seconds, reason))
+    controller.save_timeline(os.path.join(self.result_path, datetime.now().strftime(
+      "%Y%m%d%H%M%S_heating_floor{}.csv".format(floor))))
 
   def _prepare_plate_image(self):
     """
     Move robot arm to imaging pose
     Call this function before taking images
     """
-    x, y, z, roll, pitch, yaw =self.hot_plate_position
-    self.arm.set_position(x=x, y=y, yaw=yaw, speed=80, wait=True)
-    self.arm.set_position(z=z, speed=50, wait=True)
-    self.arm.close_bio_gripper()
-
-    x, y, z, roll, pitch, yaw =self.arm_position2
-    self.arm.set_position(z=z, speed=50, wait=True)
-    self.arm.set_position(x=x, y=y, yaw=yaw, speed=80, wait=True)
-
-    x, y, z, roll, pitch, yaw = self.arm_position3
-    self.arm.set_position(x=x, y=y, z=z, roll=roll, pitch=pitch, yaw=yaw, speed=80, wait=True)
-
-    x, y, z, roll, pitch, yaw = self.arm_position4
-    self.arm.set_position(x=x, y=y, roll=roll, pitch=pitch, yaw=yaw, speed=80, wait=True)
-    self.arm.set_position(z=z, speed=50, wait=True)
-
-    x, y, z, roll, pitch, yaw = self.center_photo_position
-    self.arm.set_position(x=x, y=y, z=z, roll=roll, pitch=pitch, yaw=yaw, speed=80, wait=True)
+    self._move([
+      Waypoint(80, stop=True, **pose_axes(self.hot_plate_position, "x", "y", "yaw")),
+      Waypoint(50, stop=True, **pose_axes(self.hot_plate_position, "z")),
+      "close_bio_gripper",
+      Waypoint(50, stop=True, **pose_axes(self.arm_position2, "z")),
+      Waypoint(80, **pose_axes(self.arm_position2, "x", "y", "yaw")),
+      Waypoint(80, **pose_axes(self.arm_position3, *AXES)),
+      Waypoint(80, **pose_axes(self.arm_position4, "x", "y", "roll", "pitch", "yaw")),
+      Waypoint(50, **pose_axes(self.arm_position4, "z")),
+      Waypoint(80, **pose_axes(self.center_photo_position, *AXES)),
+    ])
 
   def _get_image(self, debug=False):
     """
     Take images of well
     """
-    
-    well = self.next_drop_well
-    
+    _, image_file = self._capture_frame(debug=debug)
+    return image_file
+
+  def _well_photo_waypoints(self, well):
+    """Lift to the photo height, move over well and come down to A1_photo_position z"""
     offset_x = (well // 3) * 39.1
     offset_y = (well % 3) * 39.1
+    x, y, z, roll, pitch, yaw = self.A1_photo_position
+    return [
+      Waypoint(50, **pose_axes(self.center_photo_position, "z")),
+      Waypoint(80, x=x-offset_x, y=y-offset_y),
+      Waypoint(50, z=z),
+    ]
+
+  def _serpentine(self, wells):
+    """Order wells column by column, reversing every other column"""
+    columns = {}
+    for well in sorted(wells):
+      columns.setdefault(well // 3, []).append(well)
+    order = []
+    for i, column in enumerate(sorted(columns)):
+      order += columns[column] if i % 2 == 0 else columns[column][::-1]
+    return order
+
+  def _open_camera(self):
+    """Open the camera once; frames grabbed while moving are flushed before each capture"""
+    if self._camera is None:
+      import cv2
+      self._camera = cv2.VideoCapture(0)
+      self._camera.set(cv2.CAP_PROP_FRAME_WIDTH, 1920)
+      self._camera.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+      if self.tracer is not None:
+        self._camera = self.tracer.wrap(self._camera, "camera")
+    return self._camera
+
+  def _close_camera(self):
+    if self._camera is not None:
+      self._camera.release()
+      self._camera = None
+
+  def _read_frame(self, cap, frames=1, combine="sharpest"):
+    """
+    Read frames from an open camera after flushing its buffer
+    combine: "sharpest" keeps the frame with the highest Laplacian variance,
+    "mean" averages them to reduce sensor noise.
+    """
+    for _ in range(self.camera_flush):
+      cap.grab()
+    captured = []
+    for _ in range(frames):
+      ok, frame = cap.read()
+      if ok:
+        captured.append(frame)
+    if not captured:
+      raise RuntimeError("Failed to read a frame from the camera")
+    if combine == "mean":
+      return np.mean(captured, axis=0).astype(np.uint8)
+    return max(captured, key=_sharpness)
+
+  def _save_frame(self, well, frame):
+    import cv2
+    well_name = ['A', 'B'][well//3] + str(well%3 + 1)
+    filename = datetime.now().strftime("%Y%m%d%H%M%S_{}.jpg".format(well_name))
+    cv2.imwrite(os.path.join(self.result_path, filename), frame)
+    print("Saved image as {}".format(filename))
+    return os.path.join(self.result_path, filename)
 
-    x, y, z, roll, pitch, yaw = self.center_photo_position
-    self.arm.set_position(z=z, speed=50, wait=True)
+  def _next_image_well(self):
+    """The drop well to image next; refuses before the arm moves when the plate is done"""
+    if self.inventory.remaining("next_image_well") < 1:
+      raise ValueError("Every well of the plate is imaged; start a new one with new_plate")
+    return self.next_drop_well
 
-    x, y, z, roll, pitch, yaw = self.A1_photo_position
-    self.arm.set_position(x=x-offset_x, y=y-offset_y, speed=80, wait=True)
-    self.arm.set_position(z=z, speed=50, wait=True)
+  def _capture_frame(self, debug=False):
+    """
+    Take images of well
+    Return value: (BGR frame, path of the saved image)
+    """
+    
+    well = self._next_image_well()
+    self._move(self._well_photo_waypoints(well))
 
-    # Camera setup
-    cap = cv2.VideoCapture(0)
-    cap.set(cv2.CAP_PROP_FRAME_WIDTH, 1920)
+    # Camera setup; reuse the image_plate session if there is one
+    own_camera = self._camera is None
+    cap = self._open_camera()
 
     if debug:
+      import cv2
       # Adjust camera position
       while True:
         _, frame = cap.read()
@@ -180,77 +339,140 @@ class RoboticArm:
         # if cv2.waitKey(10) > 0:
           # break
     
-    _, frame = cap.read()
-    cap.release()
-    cv2.destroyAllWindows()
+    frame = self._read_frame(cap)
+    if own_camera:
+      self._close_camera()
     
-    now = datetime.now()
-   
-    well_name = ['A', 'B'][well//3] + str(well%3 + 1)
+    return frame, self._save_frame(well, frame)
 
-    filename = now.strftime("%Y%m%d%H%M%S_{}.jpg".format(well_name))
-    
-    cv2.imwrite(os.path.join(self.result_path, filename), frame)
-    print("Saved image as {}".format(filename))
-    return os.path.join(self.result_path, filename)
+  def image_plate(self, wells=range(6), frames=3, combine="sharpest"):
+    """
+    Image every drop well of the plate on the hotplate in one pass
+    The plate is brought to the camera once, the camera stays open, and
+    wells are visited in serpentine order. Each frame is queued for
+    analysis as soon as it is taken.
+    frames, combine: frames read per well and how they are reduced (see _read_frame).
+    Return value: Future of [1 (coffee ring) or 0, ...] in the order of wells.
+    """
+    wells = list(wells)
+    self._prepare_plate_image()
+    futures = {}
+    self._open_camera()
+    try:
+      for well in self._serpentine(wells):
+        self._move(self._well_photo_waypoints(well))
+        frame = self._read_frame(self._camera, frames, combine)
+        image_file = self._save_frame(well, frame)
+        futures[well] = self._submit_analysis([frame], [os.path.basename(image_file)])
+        report_progress("imaged", well=well, image=os.path.basename(image_file))
+    finally:
+      self._close_camera()
+    return gather_futures([chain_future(futures[well], lambda results: results[0]) for well in wells])
 
   def measure_results(self) -> int:
+    return self.submit_measurement().result()
+
+  def submit_measurement(self):
+    """
+    Take the image of the current well and queue it for analysis
+    Return value: Future of 1 (coffee ring) or 0; the arm is free once this returns.
+    """
+    self._next_image_well()
     self._prepare_plate_image()
-    image_file = self._get_image()
-    result = self._analyze_image(image_file)
-    return result
+    frame, image_file = self._capture_frame()
+    return chain_future(self._submit_analysis([frame], [os.path.basename(image_file)]),
+                        lambda results: results[0])
+
+  def _submit_analysis(self, images: list, names: list):
+    """Queue frames or image files; returns a Future of [1 or 0, ...] (None each when simulating)"""
+    if self.analysis is None:
+      print("simulated: skip analysis")
+      future = Future()
+      future.set_result([None] * len(images))
+      return future
+    future = self.analysis.submit(images, names, self.result_path)
+    return chain_future(future, lambda answers: [self._classify(ratio, tier) for ratio, tier in answers])
+
+  def _analyze_frame(self, frame, image_file: str) -> int:
+    """Analyze a frame already in memory; image_file names the result images
+    Return value: 1 (if cofee ring is observed) or 0 (otherwise).
+    """
+    return self._analyze_images([frame], [os.path.basename(image_file)])[0]
 
   def _analyze_image(self, image_file: str) -> int:
     """Analyze image
     Return value: 1 (if cofee ring is observed) or 0 (otherwise).
     """
-    ratio = detect_coffee_ring(self.fastsam_model, image_file, self.result_path)
-    print("ratio:", ratio)
+    return self._analyze_images([image_file])[0]
 
-    if ratio > 0.3:
+  def _analyze_images(self, images: list, names=None) -> list:
+    """Analyze several well images (paths or frames) with one batched FastSAM pass
+    Return value: list of 1 (coffee ring) or 0 (otherwise), in order.
+    """
+    if names is None:
+      names = [os.path.basename(image) for image in images]
+    return self._submit_analysis(images, names).result()
+
+  def _classify(self, ratio, tier="fastsam") -> int:
+    from image_analysis import RING_RATIO_THRESHOLD
+    print("ratio:", ratio, "tier:", tier)
+
+    if ratio > RING_RATIO_THRESHOLD:
       print('Coffee ring')
       return 1
     else:
       print('No coffee ring')
       return 0
 
-
-  def place_plate(self):
+  def close(self):
+    """Wait for queued analyses and their artifacts, stop the analysis worker and release the camera and hotplate"""
+    self._close_camera()
+    if self.analysis is not None:
+      self.analysis.close()
+      self.analysis = None
+    if self._hotplate is not None:
+      self._hotplate.close()
+      self._hotplate = None
+
+  def save_trace(self):
+    """Write the Chrome trace (chrome://tracing, ui.perfetto.dev) into result_path and print the summary"""
+    if self.tracer is None:
+      return None
+    self.tracer.print_summary()
+    return self.tracer.save(os.path.join(self.result_path, datetime.now().strftime("%Y%m%d%H%M%S_trace.json")))
+
+  def place_plate(self, floor=None):
     """
     Place well plate on plate hotel
+    floor: hotel floor the plate came from (default: plate_floor)
     """
-    x, y, z, roll, pitch, yaw = self.center_photo_position
-    self.arm.set_position(z=z, speed=50, wait=True)
-    self.arm.set_position(x=x, y=y, roll=roll, pitch=pitch, yaw=yaw, speed=80, wait=True)
-    
-    x, y, z, roll, pitch, yaw = self.arm_position4
-    self.arm.set_position(x=x, y=y, z=z, roll=roll, pitch=pitch, yaw=yaw, speed=80, wait=True)
-
-    x, y, z, roll, pitch, yaw = self.arm_position3
-    self.arm.set_position(z=z, speed=50, wait=True)
-    self.arm.set_position(x=x, y=y, roll=roll, pitch=pitch, yaw=yaw, speed=80, wait=True)
-
-    x, y, z, roll, pitch, yaw = self.plate_hotel_standard_position
-    self.arm.set_position(x=x, y=y, z=z, roll=roll, pitch=pitch, yaw=yaw, speed=80, wait=True)
-
-    if self.plate_floor // 6 == 0:
-        x, y, z, roll, pitch, yaw = self.plate_hotel1_z_floor_position
-    else:
-        x, y, z, roll, pitch, yaw = self.plate_hotel2_z_floor_position
-
-    z += 45.2*(self.plate_floor % 6)
-    self.arm.set_position(x=x, z=z+10, speed=80, wait=True)
-    self.arm.set_position(y=y, speed=50, wait=True)
-    self.arm.set_position(z=z, speed=10, wait=True)
-    self.arm.open_bio_gripper()
-
-    x, y, z, roll, pitch, yaw = self.plate_hotel_standard_position  
-    self.arm.set_position(y=y, speed=40, wait=True)
-    self.arm.set_position(x=x, z=z, speed=50, wait=True)
-
-    self.arm.move_gohome(wait=True)
+    floor = self.plate_floor if floor is None else floor
+    hotel = self.plate_hotel_standard_position
+    x, y, z, roll, pitch, yaw = self.hotel_floor_positions[floor]
+
+    self._move([
+      Waypoint(50, **pose_axes(self.center_photo_position, "z")),
+      Waypoint(80, **pose_axes(self.center_photo_position, "x", "y", "roll", "pitch", "yaw")),
+      Waypoint(80, **pose_axes(self.arm_position4, *AXES)),
+      Waypoint(50, **pose_axes(self.arm_position3, "z")),
+      Waypoint(80, **pose_axes(self.arm_position3, "x", "y", "roll", "pitch", "yaw")),
+      Waypoint(80, **pose_axes(hotel, *AXES)),
+      Waypoint(80, stop=True, x=x, z=z+10),
+      Waypoint(50, stop=True, y=y),
+      Waypoint(10, stop=True, z=z),
+      "open_bio_gripper",
+      Waypoint(40, stop=True, **pose_axes(hotel, "y")),
+      Waypoint(50, **pose_axes(hotel, "x", "z")),
+      "move_gohome",
+    ])
 
     #self.plate_floor -= 1
     self.dropped_wells = []
     self.next_drop_well += 1
 
+
+def _sharpness(frame):
+  """Variance of the Laplacian of a downscaled gray frame; higher is sharper"""
+  import cv2
+  gray = cv2.cvtColor(cv2.resize(frame, None, fx=0.25, fy=0.25), cv2.COLOR_BGR2GRAY)
+  return cv2.Laplacian(gray, cv2.CV_64F).var()
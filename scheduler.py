@@ -0,0 +1,234 @@
+import argparse
+import heapq
+import threading
+import time
+
+from motion import AXES, Waypoint, pose_axes
+
+# Seconds per step, used by dry runs (prepare: six wells with OT2.prepare_samples)
+DEFAULT_DURATIONS = {
+  "load": 90.0,
+  "prepare": 920.0,
+  "to_hotplate": 60.0,
+  "heat": 3600.0,
+  "measure": 150.0,
+  "place": 90.0,
+}
+
+
+class Step:
+  """
+  One step of a plate's journey through the lab
+  uses: resources held only while the step runs.
+  acquires/releases: resources taken at the start and given back at the
+  end of a (possibly later) step, e.g. the hotplate from transfer to imaging.
+  """
+  def __init__(self, name, action=None, uses=(), acquires=(), releases=(), duration=None):
+    self.name = name
+    self.action = action
+    self.uses = set(uses)
+    self.acquires = set(acquires)
+    self.releases = set(releases)
+    self.duration = DEFAULT_DURATIONS.get(name, 0.0) if duration is None else duration
+
+
+def plate_steps(robot=None, lh=None, floor=0, compositions=(), heat_debug=False, durations=None):
+  """
+  The load -> prepare -> heat -> measure -> place cycle of one plate
+  Resources: arm, ot2 (pipetting), ot2_deck (the plate slot), hotplate, camera.
+  The arm holds the plate from imaging until it is back in the hotel, so
+  measure acquires the arm and camera and place releases them.
+  Each arm step starts from home, lifted to the transit height first (the
+  arm may be parked low at the hotplate), so routines begin from their
+  usual pose even when another plate's step ran in between. Steps that depend on the
+  hotel floor get it explicitly, since plate_floor belongs to whichever
+  plate last ran an arm step.
+  results collects the measured value of every well.
+  """
+  durations = dict(DEFAULT_DURATIONS, **(durations or {}))
+  results = {}
+
+  def arm_step(fn):
+    def action():
+      robot.plate_floor = floor
+      fn()
+    return action
+
+  def from_transit_pose():
+    robot._go_home()
+    robot._move([Waypoint(80, **pose_axes(robot.arm_position1, *AXES))])
+
+  def load():
+    robot._go_home()
+    robot.load_plate(floor)
+
+  def prepare():
+    lh.inventory.new_plate(floor)
+    lh.prepare_samples(list(compositions))
+
+  def to_hotplate():
+    from_transit_pose()
+    robot._transfer_to_hotplate()
+
+  def measure():
+    from_transit_pose()
+    answers = robot.image_plate(range(len(compositions))).result()
+    results.update(enumerate(answers))
+
+  steps = [
+    Step("load", arm_step(load), uses=["arm"], acquires=["ot2_deck"]),
+    Step("prepare", prepare, uses=["ot2"]),
+    Step("to_hotplate", arm_step(to_hotplate), uses=["arm"], acquires=["hotplate"], releases=["ot2_deck"]),
+    Step("heat", lambda: robot._heat(heat_debug, floor)),
+    Step("measure", arm_step(measure), acquires=["arm", "camera"], releases=["hotplate"]),
+    Step("place", arm_step(lambda: robot.place_plate(floor)), releases=["arm", "camera"]),
+  ]
+  for step in steps:
+    step.duration = durations[step.name]
+  return steps, results
+
+
+class PlateScheduler:
+  """
+  Keep several plates in flight on shared instruments
+  While one plate heats, the next is loaded and prepared and the previous
+  one imaged. Steps of a plate run in order; a step starts once none of
+  its resources is used or held by another plate, older plates first.
+  """
+  def __init__(self, max_in_flight=3, tracer=None):
+    """tracer: tracing.Tracer that also records every step of run()"""
+    self.max_in_flight = max_in_flight
+    self.tracer = tracer
+    self.timeline = []
+
+  def _can_start(self, plate, step, held, busy, in_flight, started):
+    if not started and in_flight >= self.max_in_flight:
+      return False
+    for resource in step.uses | step.acquires:
+      if resource in busy or held.get(resource, plate) != plate:
+        return False
+    return True
+
+  def _start(self, plate, step, held, busy):
+    busy.update(step.uses)
+    for resource in step.acquires:
+      held[resource] = plate
+
+  def _finish(self, plate, step, held, busy):
+    busy.difference_update(step.uses)
+    for resource in step.releases:
+      held.pop(resource, None)
+
+  def dry_run(self, plates):
+    """
+    Simulate plates (lists of Steps) with their durations
+    Return value: makespan, projected plates/day and the serial equivalent.
+    """
+    held, busy = {}, set()
+    next_step = [0] * len(plates)
+    running = []
+    timeline = []
+    now = 0.0
+    in_flight = 0
+
+    while True:
+      started = True
+      while started:
+        started = False
+        active = {plate for _, plate, _ in running}
+        for plate, steps in enumerate(plates):
+          if plate in active or next_step[plate] >= len(steps):
+            continue
+          step = steps[next_step[plate]]
+          if self._can_start(plate, step, held, busy, in_flight, next_step[plate] > 0):
+            if next_step[plate] == 0:
+              in_flight += 1
+            self._start(plate, step, held, busy)
+            heapq.heappush(running, (now + step.duration, plate, step.name))
+            timeline.append({"plate": plate, "step": step.name, "start": now, "end": now + step.duration})
+            active.add(plate)
+            started = True
+      if not running:
+        break
+      now, plate, _ = heapq.heappop(running)
+      step = plates[plate][next_step[plate]]
+      self._finish(plate, step, held, busy)
+      next_step[plate] += 1
+      if next_step[plate] == len(plates[plate]):
+        in_flight -= 1
+
+    if any(n < len(steps) for n, steps in zip(next_step, plates)):
+      raise RuntimeError("Schedule deadlocked")
+    serial = sum(step.duration for steps in plates for step in steps)
+    self.timeline = timeline
+    return {
+      "makespan": now,
+      "plates_per_day": 86400 * len(plates) / now if now else 0.0,
+      "serial_plates_per_day": 86400 * len(plates) / serial if serial else 0.0,
+      "timeline": timeline,
+    }
+
+  def run(self, plates):
+    """Execute plates on the instruments, one thread per plate"""
+    condition = threading.Condition()
+    held, busy = {}, set()
+    state = {"in_flight": 0}
+    errors = []
+    self.timeline = []
+
+    def worker(plate, steps):
+      for i, step in enumerate(steps):
+        with condition:
+          condition.wait_for(lambda: errors or self._can_start(plate, step, held, busy,
+                                                                state["in_flight"], i > 0))
+          if errors:
+            return
+          if i == 0:
+            state["in_flight"] += 1
+          self._start(plate, step, held, busy)
+        start = time.time()
+        try:
+          print("plate {}: {} started".format(plate, step.name))
+          step.action()
+        except Exception as e:
+          errors.append(e)
+        finally:
+          end = time.time()
+          with condition:
+            self._finish(plate, step, held, busy)
+            if i == len(steps) - 1 or errors:
+              state["in_flight"] -= 1
+            self.timeline.append({"plate": plate, "step": step.name, "start": start, "end": end})
+            if self.tracer is not None:
+              self.tracer.record(step.name, "plate{}".format(plate), start*1e6, end*1e6)
+            condition.notify_all()
+        if errors:
+          return
+
+    threads = [threading.Thread(target=worker, args=(plate, steps), name="plate{}".format(plate))
+               for plate, steps in enumerate(plates)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    if errors:
+      raise errors[0]
+    return self.timeline
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Project throughput of the pipelined plate schedule")
+  parser.add_argument("--plates", type=int, default=6)
+  parser.add_argument("--in-flight", type=int, default=3)
+  for name, seconds in DEFAULT_DURATIONS.items():
+    parser.add_argument("--" + name.replace("_", "-"), type=float, default=seconds, dest=name,
+                        help="seconds (default {})".format(seconds))
+  args = parser.parse_args()
+
+  durations = {name: getattr(args, name) for name in DEFAULT_DURATIONS}
+  plates = [plate_steps(floor=floor, durations=durations)[0] for floor in range(args.plates)]
+  report = PlateScheduler(args.in_flight).dry_run(plates)
+  for entry in report["timeline"]:
+    print("plate {plate}: {step:<12} {start:8.0f} - {end:8.0f} s".format(**entry))
+  print("makespan {:.0f} s: {:.1f} plates/day (serial {:.1f})".format(
+    report["makespan"], report["plates_per_day"], report["serial_plates_per_day"]))
@@ -0,0 +1,117 @@
+import os
+
+import pytest
+
+from motion import Waypoint, compile_motion
+from robotic_arm import RoboticArm
+
+START = [0.0, 0.0, 100.0, 180, 0, 0]
+
+
+def moves(commands):
+  return [command for command in commands if command[0] == "move"]
+
+
+def test_stop_waypoints_come_to_rest():
+  commands = compile_motion(START, [
+    Waypoint(80, x=100),
+    Waypoint(50, stop=True, z=20),
+    Waypoint(80, x=200),
+    Waypoint(80, y=100),
+  ])
+  (_, _, _, r1, w1), (_, _, _, r2, w2), (_, _, _, r3, w3), (_, _, _, r4, w4) = moves(commands)
+  assert r1 is not None and not w1
+  assert r2 is None and w2
+  assert r3 is not None and not w3
+  # The last waypoint always stops
+  assert r4 is None and w4
+
+
+def test_waypoint_before_gripper_call_stops():
+  commands = compile_motion(START, [
+    Waypoint(80, x=100),
+    Waypoint(80, z=20),
+    "close_bio_gripper",
+    Waypoint(80, z=100),
+  ])
+  assert commands[1] == ("move", [100, 0.0, 20, 180, 0, 0], 80, None, True)
+  assert commands[2] == ("call", "close_bio_gripper")
+
+
+def test_no_radius_stops_everywhere():
+  commands = compile_motion(START, [Waypoint(80, x=100), Waypoint(80, y=100), Waypoint(80, z=0)], radius=None)
+  assert all(blend is None and wait for _, _, _, blend, wait in moves(commands))
+
+
+def test_blend_limited_to_half_of_adjacent_segments():
+  commands = compile_motion(START, [Waypoint(80, x=10), Waypoint(80, x=100), Waypoint(80, y=100)], radius=20.0)
+  assert moves(commands)[0][3] == pytest.approx(5.0)
+  assert moves(commands)[1][3] == pytest.approx(20.0)
+
+
+@pytest.fixture
+def robot():
+  return RoboticArm(simulate=True)
+
+
+def test_simulated_arm_keeps_results_out_of_the_repository(robot):
+  assert not os.path.abspath(robot.result_path).startswith(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.mark.parametrize("routine", ["load_plate", "_transfer_to_hotplate", "_prepare_plate_image", "place_plate"])
+def test_routines_stop_for_gripper_and_marked_waypoints(robot, routine):
+  sequences = []
+  move = robot._move
+  robot._move = lambda sequence: (sequences.append(sequence), move(sequence))
+  getattr(robot, routine)()
+  assert sequences
+
+  for sequence in sequences:
+    commands = compile_motion(START, sequence, robot.blend_radius)
+    waypoints = iter(item for item in sequence if isinstance(item, Waypoint))
+    for i, command in enumerate(commands):
+      if command[0] != "move":
+        continue
+      waypoint = next(waypoints)
+      following = commands[i+1] if i + 1 < len(commands) else None
+      if waypoint.stop or following is None or following[0] == "call":
+        assert command[3] is None and command[4], (routine, waypoint)
+
+
+def gripper_poses(robot):
+  poses = []
+  close = robot.arm.close_bio_gripper
+  robot.arm.close_bio_gripper = lambda **kwargs: (poses.append(list(robot.arm.position)), close(**kwargs))
+  return poses
+
+
+def test_scheduled_transfer_picks_up_where_the_serial_one_does():
+  from scheduler import plate_steps
+
+  serial = RoboticArm(simulate=True)
+  serial_poses = gripper_poses(serial)
+  serial.load_plate(5)
+  serial._transfer_to_hotplate()
+
+  scheduled = RoboticArm(simulate=True)
+  scheduled_poses = gripper_poses(scheduled)
+  steps, _ = plate_steps(scheduled, floor=5)
+  steps[0].action()
+  steps[2].action()
+
+  assert scheduled_poses[1] == serial_poses[1] == scheduled.OT2_deck2_position
+
+
+def test_scheduled_arm_steps_lift_before_going_home():
+  from scheduler import plate_steps
+
+  robot = RoboticArm(simulate=True)
+  steps, _ = plate_steps(robot, floor=5)
+  steps[0].action()
+  steps[2].action()
+  assert not robot.inventory.state["arm_home"]
+  start = len(robot.arm.path)
+  steps[0].action()
+  lift, home = robot.arm.path[start:start+2]
+  assert lift["pose"][:2] == robot.hot_plate_position[:2] and lift["pose"][2] == robot.arm_position1[2]
+  assert home["pose"] == robot.arm.home
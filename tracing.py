@@ -0,0 +1,137 @@
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+
+def _now_us():
+  return time.time() * 1e6
+
+
+def _describe(value, limit=60):
+  """Short, cheap description of an argument for the trace"""
+  if isinstance(value, np.ndarray):
+    return "ndarray{}".format(value.shape)
+  text = repr(value)
+  return text if len(text) <= limit else text[:limit] + "..."
+
+
+class Tracer:
+  """
+  Opt-in timeline of device calls and analysis stages
+  Events are Chrome trace "complete" events (ph "X", microseconds), so a
+  saved file opens in chrome://tracing or ui.perfetto.dev. Timestamps are
+  wall clock, which lets events from the analysis worker process line up.
+  """
+  def __init__(self):
+    self.events = []
+    self._lock = threading.Lock()
+
+  def record(self, name, device, start, end, args=None):
+    event = {"name": name, "cat": device, "ph": "X", "ts": start, "dur": end - start,
+             "pid": os.getpid(), "tid": threading.get_ident() % 100000}
+    if args:
+      event["args"] = args
+    with self._lock:
+      self.events.append(event)
+
+  def extend(self, events):
+    with self._lock:
+      self.events.extend(events)
+
+  def drain(self):
+    """Return and forget the events recorded so far"""
+    with self._lock:
+      events, self.events = self.events, []
+    return events
+
+  @contextmanager
+  def span(self, name, device, **args):
+    start = _now_us()
+    try:
+      yield
+    finally:
+      self.record(name, device, start, _now_us(), {k: _describe(v) for k, v in args.items()})
+
+  def wrap(self, obj, device):
+    """Proxy of obj whose method calls (plain or async) are recorded under device"""
+    return _TracedProxy(obj, device, self)
+
+  def summary(self):
+    """{(device, name): {"calls", "total_s", "mean_s", "max_s"}}, slowest total first"""
+    table = {}
+    for event in self.events:
+      entry = table.setdefault((event["cat"], event["name"]), {"calls": 0, "total_s": 0.0, "max_s": 0.0})
+      seconds = event["dur"] / 1e6
+      entry["calls"] += 1
+      entry["total_s"] += seconds
+      entry["max_s"] = max(entry["max_s"], seconds)
+    for entry in table.values():
+      entry["mean_s"] = entry["total_s"] / entry["calls"]
+    return dict(sorted(table.items(), key=lambda item: -item[1]["total_s"]))
+
+  def print_summary(self):
+    print("{:<10} {:<28} {:>6} {:>10} {:>9} {:>9}".format("device", "call", "calls", "total s", "mean s", "max s"))
+    for (device, name), entry in self.summary().items():
+      print("{:<10} {:<28} {:>6} {:>10.2f} {:>9.3f} {:>9.3f}".format(
+        device, name, entry["calls"], entry["total_s"], entry["mean_s"], entry["max_s"]))
+
+  def save(self, path):
+    with self._lock:
+      events = list(self.events)
+    with open(path, "w") as f:
+      json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+    return path
+
+
+class _TracedProxy:
+  """Forward attribute access to the wrapped object, timing every method call"""
+  def __init__(self, obj, device, tracer):
+    object.__setattr__(self, "_obj", obj)
+    object.__setattr__(self, "_device", device)
+    object.__setattr__(self, "_tracer", tracer)
+
+  def __getattr__(self, name):
+    value = getattr(self._obj, name)
+    if not callable(value) or name.startswith("__"):
+      return value
+    device, tracer = self._device, self._tracer
+
+    def args_of(args, kwargs):
+      described = {str(i): _describe(arg) for i, arg in enumerate(args)}
+      described.update((key, _describe(arg)) for key, arg in kwargs.items())
+      return described
+
+    if inspect.iscoroutinefunction(value):
+      @functools.wraps(value)
+      async def traced_async(*args, **kwargs):
+        start = _now_us()
+        try:
+          return await value(*args, **kwargs)
+        finally:
+          tracer.record(name, device, start, _now_us(), args_of(args, kwargs))
+      return traced_async
+
+    @functools.wraps(value)
+    def traced(*args, **kwargs):
+      start = _now_us()
+      try:
+        return value(*args, **kwargs)
+      finally:
+        tracer.record(name, device, start, _now_us(), args_of(args, kwargs))
+    return traced
+
+  def __setattr__(self, name, value):
+    setattr(self._obj, name, value)
+
+  def __enter__(self):
+    self._obj.__enter__()
+    return self
+
+  def __exit__(self, *exc):
+    return self._obj.__exit__(*exc)
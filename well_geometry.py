@@ -0,0 +1,109 @@
+import argparse
+import glob
+import json
+import os
+import re
+import threading
+
+import numpy as np
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "well_geometry.json")
+# "20251113100536_A1.jpg" -> "A1"
+_WELL_NAME = re.compile(r"_([A-H]\d{1,2})(?:\.\w+)?$")
+
+def well_id(name):
+    """Plate well of an image name, or None if the name carries none."""
+    match = _WELL_NAME.search(os.path.basename(name))
+    return match.group(1) if match else None
+
+class WellGeometry:
+    """Expected Hough circle (x, y, r in crop coordinates) of every plate well.
+
+    The arm photographs each well from a fixed pose, so the well lands at
+    nearly the same place in every crop. The prior of a well is the median
+    of its last `history` detections; wells with fewer than min_samples use
+    the median over all wells. Its tolerance is 3x the spread of those
+    detections, at least min_tolerance px.
+    learn=False only reads the file (e.g. parallel reanalyze workers).
+    path None keeps the geometry in memory only.
+    """
+    def __init__(self, path=DEFAULT_PATH, history=20, min_samples=3, min_tolerance=20, learn=True):
+        self.path = path
+        self.history = history
+        self.min_samples = min_samples
+        self.min_tolerance = min_tolerance
+        self.learn = learn
+        self._lock = threading.Lock()
+        self.circles = {}
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                self.circles = json.load(f).get("circles", {})
+
+    def _estimate(self, circles):
+        circles = np.asarray(circles, dtype=float)
+        x, y, r = np.median(circles, axis=0)
+        spread = max(np.median(np.hypot(circles[:, 0] - x, circles[:, 1] - y)),
+                     np.median(np.abs(circles[:, 2] - r)))
+        return float(x), float(y), float(r), max(float(self.min_tolerance), 3*float(spread))
+
+    def prior(self, name):
+        """(x, y, r, tolerance) expected for the well of image name, or None if unknown."""
+        well = well_id(name)
+        with self._lock:
+            own = self.circles.get(well, []) if well is not None else []
+            if len(own) >= self.min_samples:
+                return self._estimate(own)
+            pooled = [circle for circles in self.circles.values() for circle in circles]
+        if len(pooled) >= self.min_samples:
+            return self._estimate(pooled)
+        return None
+
+    def observe(self, name, circle):
+        """Add a Hough detection of the well of image name and save."""
+        well = well_id(name)
+        if not self.learn or well is None:
+            return
+        with self._lock:
+            circles = self.circles.setdefault(well, [])
+            circles.append([int(v) for v in circle])
+            del circles[:-self.history]
+        self.save()
+
+    def save(self):
+        if self.path is None:
+            return
+        with self._lock:
+            tmp = self.path + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump({"circles": self.circles}, f, indent=1)
+            os.replace(tmp, self.path)
+
+def seed(geometry, results_dir="results"):
+    """Learn the geometry from the full-crop Hough circles of the images in results_dir."""
+    import image_analysis as ia
+
+    found = 0
+    paths = sorted(glob.glob(os.path.join(results_dir, "**", "*.jpg"), recursive=True))
+    for path in paths:
+        if well_id(path) is None:
+            continue
+        circle = ia._hough_circle(ia._edge_map(ia._crop_center(ia._load_image(path))))
+        if circle is not None:
+            geometry.observe(path, circle)
+            found += 1
+    return found
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Learn and show the expected well circles")
+    parser.add_argument("--path", default=DEFAULT_PATH)
+    parser.add_argument("--seed", default=None, help="results directory to learn from")
+    args = parser.parse_args()
+
+    geometry = WellGeometry(args.path)
+    if args.seed:
+        print("learned {} circles".format(seed(geometry, args.seed)))
+    for well in sorted(geometry.circles):
+        prior = geometry.prior("_" + well)
+        print("{:<4} {:>3} detections, prior {}".format(
+            well, len(geometry.circles[well]),
+            "none" if prior is None else "x {:.0f} y {:.0f} r {:.0f} +/- {:.0f}".format(*prior)))